@@ -27,6 +27,7 @@ app.mount("/static", StaticFiles(directory=config.PkgBot.get("jinja_static")), n
 app.include_router(api.views.router)
 app.include_router(api.auth.router)
 app.include_router(api.autopkg.router)
+app.include_router(api.jamf_pro.router)
 app.include_router(api.package.router)
 app.include_router(api.policy.router)
 app.include_router(api.recipe.router)
@@ -73,6 +74,7 @@ async def number_of_workers():
 @app.on_event("startup")
 async def startup_event():
 
+	core.jamf_pro.http_client.start()
 	pkgbot_admins = config.PkgBot.get("Admins")
 
 	for admin in pkgbot_admins:
@@ -84,6 +86,12 @@ async def startup_event():
 		await core.user.create_or_update(user_object)
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+
+	await core.jamf_pro.http_client.close()
+
+
 if __name__ == "__main__":
 
 	uvicorn.run(
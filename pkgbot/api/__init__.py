@@ -1,6 +1,5 @@
 import hashlib
 import hmac
-import json
 
 from fastapi import Request
 
@@ -8,6 +7,7 @@ from . import (
 	auth,
 	autopkg,
 	build_msg,
+	jamf_pro,
 	package,
 	policy,
 	send_msg,
@@ -28,7 +28,7 @@ if config.Slack:
 	from . import slackbot as chatbot
 
 
-async def verify_pkgbot_webhook(request: Request):
+async def verify_pkgbot_webhook(request: Request, body: bytes | None = None):
 
 	try:
 ##### Add a timestamp check
@@ -39,11 +39,9 @@ async def verify_pkgbot_webhook(request: Request):
 		# 	# It could be a replay attack, so let's ignore it.
 		# 	return False
 
-		body = json.loads(await request.body())
-
 		digest = await utility.compute_hex_digest(
 			config.PkgBot.get("webhook_secret").encode("UTF-8"),
-			str(body).encode("UTF-8"),
+			body if body is not None else await request.body(),
 			hashlib.sha512
 		)
 
@@ -60,3 +58,30 @@ async def verify_pkgbot_webhook(request: Request):
 	except Exception:
 		log.error("Exception attempting to validate PkgBot Webhook!")
 		return False
+
+
+async def verify_jamf_pro_webhook(request: Request):
+	"""Verifies a Jamf Pro webhook was sent with the configured shared secret.
+
+	Jamf Pro does not sign webhooks, so the webhook must be configured to use
+	"Header Authentication" with the header:  `{ "Authorization": "Bearer <webhook_secret>" }`
+	"""
+
+	try:
+
+		if not (webhook_secret := config.JamfPro_Prod.get("webhook_secret")):
+			log.warning("A Jamf Pro Webhook was received, but a `webhook_secret` is not configured!")
+			return False
+
+		if hmac.compare_digest(
+			f"Bearer {webhook_secret}".encode("UTF-8"),
+			(request.headers.get("authorization")).encode("UTF-8")
+		):
+			return True
+
+		log.warning("Invalid Jamf Pro Webhook message!")
+		return False
+
+	except Exception:
+		log.error("Exception attempting to validate Jamf Pro Webhook!")
+		return False
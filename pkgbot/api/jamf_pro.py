@@ -0,0 +1,42 @@
+from fastapi import APIRouter, Body, Depends, HTTPException, Request, Response, status
+
+from pkgbot import api, core, settings
+from pkgbot.utilities import common as utility
+
+
+log = utility.log
+
+router = APIRouter(
+	prefix = "/jamf_pro",
+	tags = ["jamf_pro"],
+	responses = settings.api.custom_responses
+)
+
+
+@router.post("/webhook", summary="Handles incoming Jamf Pro webhooks",
+	description="This endpoint receives incoming Jamf Pro webhook events and updates the cached "
+		"Policies and Packages affected by the event after verifying the authenticity of the source.")
+async def webhook(request: Request, payload: dict = Body()):
+
+	if not await api.verify_jamf_pro_webhook(request):
+		raise HTTPException(
+			status_code=status.HTTP_511_NETWORK_AUTHENTICATION_REQUIRED,
+			detail="Failed to authenticate webhook."
+		)
+
+	await core.jamf_pro.webhook_handler(payload)
+	return Response(status_code=status.HTTP_200_OK)
+
+
+@router.get("/stats", summary="Get Jamf Pro API client statistics",
+	description="Get statistics for the Jamf Pro API client of each process (the API and each "
+		"Celery worker process), keyed by `<hostname>:<pid>`.  Each process' statistics are "
+		"cumulative since it started and are saved at most every `stats.interval` seconds:  "
+		"its response cache (hits, misses, evictions and invalidations), adaptive concurrency "
+		"limiter (current limit, requests in flight and decreases) and request latency histograms "
+		"(seconds per method and endpoint, from sending a request to receiving its response, "
+		"for each attempt including retries).",
+	dependencies=[Depends(core.user.verify_admin)], response_model=dict)
+async def stats():
+
+	return await core.jamf_pro.get_stats()
@@ -1,4 +1,7 @@
-from fastapi import APIRouter, Body, Depends, HTTPException, Response, Request, status
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Response, Request, status
+from kombu.utils import json as kombu_json
 
 from pkgbot import api, config, core, settings
 from pkgbot.db import schemas
@@ -25,33 +28,55 @@ async def results(task_id:  str):
 @router.post("/receive", summary="Handles incoming task messages with autopkg results",
 	description="This endpoint receives incoming messages from tasks and calls the required "
 		"actions based on the message after verifying the authenticity of the source.")
-async def receive(request: Request, task_id = Body()):
+async def receive(request: Request):
+
+	max_size = config.PkgBot.get("webhook_max_size", 1_000_000)
+
+	try:
+		content_length = int(request.headers.get("content-length", 0))
+	except ValueError:
+		log.error(f"Invalid Content-Length ({request.headers.get('content-length')})")
+		return Response(status_code=status.HTTP_400_BAD_REQUEST)
 
-##### TODO:
 	# To prevent memory allocation attacks
-	# if content_length > 1_000_000:
-	# 	log.error(f"Content too long ({content_length})")
-	# 	response.status_code = 400
-	# 	return {"result": "Content too long"}
+	if content_length > max_size:
+		log.error(f"Content too long ({content_length})")
+		return Response(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+	# The limit is also enforced on the body as it is read, e.g. chunked bodies have no length
+	body = bytearray()
 
-	if not await api.verify_pkgbot_webhook(request):
-		return HTTPException(
+	async for chunk in request.stream():
+
+		body.extend(chunk)
+
+		if len(body) > max_size:
+			log.error(f"Content too long (more than {max_size} bytes read)")
+			return Response(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+	if not await api.verify_pkgbot_webhook(request, bytes(body)):
+		raise HTTPException(
 			status_code=status.HTTP_511_NETWORK_AUTHENTICATION_REQUIRED,
 			detail="Failed to authenticate webhook."
 		)
 
-	task_id = task_id.get("task_id")
+	# Decoded the same as results from the result backend
+	webhook = kombu_json.loads(bytes(body))
+	task_id = webhook.get("task_id")
 	log.debug(f"Receiving notification for task_id:  {task_id}")
-	await core.events.event_handler(task_id)
+	await core.events.event_handler(task_id, task_results=webhook.get("task_results"))
 	return Response(status_code=status.HTTP_200_OK)
 
 
 @router.get("/cache_policies", summary="Adhoc cache policies from Jamf Pro",
-	description="Force an adhoc cache of Jamf Pro Policies.",
+	description="Force an adhoc cache of Jamf Pro Policies.  A `delta` cache only retrieves "
+		"the details of Policies that are new or renamed since the last cache.",
 	dependencies=[Depends(core.user.verify_admin)], response_model=dict)
-async def cache_policies(user_object: schemas.PkgBotAdmin_In = Depends(core.user.get_current)):
+async def cache_policies(mode: Literal["full", "delta"] = "full",
+	user_object: schemas.PkgBotAdmin_In = Depends(core.user.get_current)):
 
-	queued_task = await core.policy.cache_policies(source="API", called_by=user_object.username)
+	queued_task = await core.policy.cache_policies(
+		source="API", called_by=user_object.username, mode=mode)
 	return {
 		"result": "Caching Policies.  See queued background task id for status.",
 		"task_id": queued_task.id
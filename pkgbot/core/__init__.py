@@ -5,7 +5,9 @@ from . import (
 	jamf_pro,
 	package,
 	policy,
+	pre_check,
 	recipe,
+	trust,
 	user,
 	views
 )
@@ -15,9 +15,14 @@ config = config.load_config()
 log = utility.log
 
 
-async def event_handler(task_id, loop_count=0):
+async def event_handler(task_id, loop_count=0, task_results=None):
 
-	task_results = (await utility.get_task_results(task_id)).get("task_results")
+	if task_results is not None:
+		# Results were sent with the webhook
+		task_results = await utility.replace_sensitive_strings(task_results)
+
+	else:
+		task_results = (await utility.get_task_results(task_id)).get("task_results")
 	# log.debug(f"task_results: {task_results}")
 	# log.debug(f"task_results.type: {type(task_results)}")
 
@@ -70,6 +75,28 @@ async def event_handler(task_id, loop_count=0):
 		case event if event in ("recipe_run_dev", "recipe_run_prod"):
 			await event_recipe_run(task_results)
 
+		case "verify_trust_batch":
+			for recipe_results in task_results.get("recipe_results"):
+				try:
+					if recipe_results.get("event") == "verify_trust_info":
+						await event_verify_trust_info(recipe_results)
+					else:
+						await event_error(recipe_results)
+				except Exception as error:
+					log.error(f"Failed to handle the results of recipe "
+						f"{recipe_results.get('recipe_id')} in task {task_id}:  {error}")
+
+		case "recipe_run_batch":
+			for recipe_results in task_results.get("recipe_results"):
+				try:
+					if recipe_results.get("event") == "verify_trust_info":
+						await event_verify_trust_info(recipe_results)
+					else:
+						await event_recipe_run(recipe_results)
+				except Exception as error:
+					log.error(f"Failed to handle the results of recipe "
+						f"{recipe_results.get('recipe_id')} in task {task_id}:  {error}")
+
 		case "autopkg_version":
 			await event_autopkg_version(task_results)
 
@@ -190,6 +217,28 @@ async def event_failed_pre_checks(task_results):
 	for task_id in task_results.get("task_id"):
 
 		child_task_results = (await utility.get_task_results(task_id)).get("task_results")
+
+		if child_task_results is None:
+			""" If a pre-check (or the dispatch after them) raised """
+
+			results = await core.chatbot.send.acknowledge_msg(
+				"Error while performing pre-checks",
+				f"```{stderr}```",
+				config.PkgBot.get('icon_error')
+			)
+
+			# Create DB entry
+			await core.error.create({
+				"type": "failed_pre_checks",
+				"slack_ts": results.get("ts"),
+				"slack_channel": results.get("channel"),
+				"status": "Notified",
+				"task_id": task_id,
+				"details": stderr
+			})
+
+			continue
+
 		event = child_task_results.get("event")
 
 		if event == "autopkg_repo_update":
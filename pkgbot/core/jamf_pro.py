@@ -1,11 +1,20 @@
+import asyncio
+import collections
+import hashlib
+import os
+import random
 import re
+import socket
+import time
 
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from xml.etree import ElementTree
 
 import httpx
 
-from pkgbot import config
+from pkgbot import config, core
+from pkgbot.db import models
 from pkgbot.utilities import common as utility
 
 
@@ -16,15 +25,114 @@ API_USER = config.JamfPro_Prod.get("api_user")
 API_PASSWORD = config.JamfPro_Prod.get("api_password")
 API_TOKEN = None
 API_TOKEN_EXPIRES = 0
+# The only Policy subsets PkgBot reads
+POLICY_SUBSETS = ("General", "Packages")
+
+
+class HTTPClientManager:
+	"""Manages a long-lived, connection pooling HTTP client for the Jamf Pro API.
+
+	Connections are bound to the event loop that opened them, so a client is kept for each
+	event loop it is requested from.  Clients of event loops that have since been closed are
+	released.
+	"""
+
+	def __init__(self):
+
+		self._clients = {}
+		self._unbound_client = None
+
+
+	def _create(self):
+
+		client_config = config.JamfPro_Prod.get("http_client") or {}
+		options = {
+			"base_url": JPS_URL,
+			"verify": config.JamfPro_Prod.get("verify_ssl", True),
+			"limits": httpx.Limits(
+				max_connections = client_config.get("max_connections", 20),
+				max_keepalive_connections = client_config.get("max_keepalive_connections", 10),
+				keepalive_expiry = client_config.get("keepalive_expiry", 30)
+			),
+			"timeout": httpx.Timeout(
+				client_config.get("timeout", 30),
+				connect = client_config.get("connect_timeout", 10)
+			)
+		}
+
+		try:
+			return httpx.AsyncClient(http2=client_config.get("http2", False), **options)
+
+		except ImportError:
+			log.warning("HTTP/2 support requires the `h2` package; falling back to HTTP/1.1")
+			return httpx.AsyncClient(**options)
+
+
+	def start(self):
+
+		if self._unbound_client is None or self._unbound_client.is_closed:
+			log.debug("Starting Jamf Pro HTTP client...")
+			self._unbound_client = self._create()
+
+
+	def get(self):
+
+		loop = asyncio.get_running_loop()
+
+		for closed_loop in [ other_loop for other_loop in self._clients if other_loop.is_closed() ]:
+			# Its connections can no longer be closed cleanly; they are closed when released
+			log.debug("Releasing the Jamf Pro HTTP client of a closed event loop...")
+			del self._clients[closed_loop]
+
+		client = self._clients.get(loop)
+
+		if client is None or client.is_closed:
+
+			if self._unbound_client is not None and not self._unbound_client.is_closed:
+				# The client created by `start()` is bound to the first event loop it is used in
+				client, self._unbound_client = self._unbound_client, None
+			else:
+				client = self._create()
+
+			self._clients[loop] = client
+
+		return client
+
+
+	async def close(self):
+
+		loop = asyncio.get_running_loop()
+		clients, self._clients = self._clients, {}
+
+		if self._unbound_client is not None:
+			clients[loop] = clients.get(loop) or self._unbound_client
+			self._unbound_client = None
+
+		for client_loop, client in clients.items():
+
+			if client.is_closed:
+				continue
+
+			log.debug("Closing Jamf Pro HTTP client...")
+
+			try:
+				if client_loop is loop:
+					await client.aclose()
+				elif client_loop.is_running():
+					asyncio.run_coroutine_threadsafe(client.aclose(), client_loop)
+			except Exception as error:
+				log.debug(f"Failed to cleanly close the Jamf Pro HTTP client:  {error}")
+
+
+http_client = HTTPClientManager()
 
 
 async def get_token(username: str = API_USER, password: str = API_PASSWORD):
 
 	try:
 
-		async with httpx.AsyncClient() as client:
-			response_get_token = await client.post(
-				f"{JPS_URL}/api/v1/auth/token", auth=(username, password))
+		response_get_token = await http_client.get().post(
+			"api/v1/auth/token", auth=(username, password))
 
 		if response_get_token.status_code == 200:
 
@@ -59,73 +167,742 @@ async def fixup_token_expiration(token_expires: str):
 		return 0
 
 
+class JamfTokenManager:
+	"""Caches a Jamf Pro API Token per set of credentials and renews each Token shortly before
+	it expires.
+
+	Renewals are single-flight:  concurrent coroutines needing the same Token wait on the one
+	in-flight renewal instead of each requesting a new Token.
+	"""
+
+	def __init__(self, refresh_margin: int = 300):
+
+		self.refresh_margin = timedelta(seconds=refresh_margin)
+		self.keep_alive_supported = True
+		self._tokens = {}
+		self._locks = {}
+		self._loop = None
+
+
+	@staticmethod
+	def _key(username: str, password: str):
+
+		return username, hashlib.sha256(str(password).encode("UTF-8")).hexdigest()
+
+
+	def _lock(self, key: tuple):
+
+		loop = asyncio.get_running_loop()
+
+		# Locks are bound to the event loop they are first used in
+		if self._loop is not loop:
+			self._locks = {}
+			self._loop = loop
+
+		return self._locks.setdefault(key, asyncio.Lock())
+
+
+	def _valid_token(self, key: tuple):
+
+		api_token, api_token_expires = self._tokens.get(key, (None, None))
+
+		if (
+			api_token and isinstance(api_token_expires, datetime) and
+			datetime.now(timezone.utc) < (api_token_expires - self.refresh_margin)
+		):
+			return api_token
+
+
+	async def get_token(self, username: str = API_USER, password: str = API_PASSWORD):
+
+		key = self._key(username, password)
+
+		if api_token := self._valid_token(key):
+			return api_token
+
+		async with self._lock(key):
+
+			# Another coroutine may have renewed the Token while waiting on the lock
+			if api_token := self._valid_token(key):
+				return api_token
+
+			api_token, api_token_expires = await self._renew(key, username, password)
+
+			if api_token:
+				self._tokens[key] = (api_token, api_token_expires)
+			else:
+				self._tokens.pop(key, None)
+
+			return api_token
+
+
+	async def _renew(self, key: tuple, username: str, password: str):
+
+		api_token, api_token_expires = self._tokens.get(key, (None, None))
+
+		if (
+			self.keep_alive_supported and api_token and
+			isinstance(api_token_expires, datetime) and
+			datetime.now(timezone.utc) < api_token_expires
+		):
+			log.debug("Renewing API Token...")
+			response_keep_alive = await http_client.get().post(
+				"api/v1/auth/keep-alive", headers = { "Authorization": f"Bearer {api_token}" })
+
+			if response_keep_alive.status_code == 200:
+				response_json = response_keep_alive.json()
+				return (
+					response_json["token"],
+					await fixup_token_expiration(response_json["expires"])
+				)
+
+			if response_keep_alive.status_code == 404:
+				log.debug("The keep-alive endpoint is not available; requesting new API Tokens")
+				self.keep_alive_supported = False
+
+		log.debug("Requesting API Token...")
+		return await get_token(username, password)
+
+
+	def invalidate(self, username: str = API_USER, password: str = API_PASSWORD):
+
+		self._tokens.pop(self._key(username, password), None)
+
+
+token_manager = JamfTokenManager(config.JamfPro_Prod.get("token_refresh_margin", 300))
+
+
+class ResponseCache:
+	"""A size bounded, LRU evicting, TTL cache of successful Jamf Pro API `GET` responses.
+
+	Entries are keyed by the Jamf Pro instance, endpoint, content type and (a hash of) the
+	credentials used for the request.
+	Any `post`/`put`/`delete` to a resource invalidates the cached responses for that resource
+	(including its subsets) and its parent collection.
+
+	The cache is per process and is not invalidated by changes made in Jamf Pro or by other
+	processes, so responses that are modified and written back (i.e. read-modify-write) must
+	not be read from it (`use_cache=False`).
+	"""
+
+	def __init__(self, enabled: bool = False, ttl: int = 60, max_entries: int = 512):
+
+		self.enabled = enabled
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.invalidations = 0
+		self._entries = collections.OrderedDict()
+
+
+	@staticmethod
+	def resource(endpoint: str):
+
+		return re.sub(r"/subset/.*$", "", endpoint.split("?", 1)[0].strip("/"))
+
+
+	@staticmethod
+	def key(endpoint: str, in_content_type: str, credentials: tuple, instance: str = JPS_URL):
+
+		return (
+			str(instance).rstrip("/"),
+			endpoint.strip("/"),
+			in_content_type,
+			hashlib.sha256(repr(credentials).encode("UTF-8")).hexdigest()
+		)
+
+
+	def get(self, key: tuple):
+
+		if entry := self._entries.get(key):
+
+			expires, response = entry
+
+			if time.monotonic() < expires:
+				self._entries.move_to_end(key)
+				self.hits = self.hits + 1
+				return response
+
+			del self._entries[key]
+
+		self.misses = self.misses + 1
+
+
+	def set(self, key: tuple, response: httpx.Response):
+
+		self._entries[key] = (time.monotonic() + self.ttl, response)
+		self._entries.move_to_end(key)
+
+		while len(self._entries) > self.max_entries:
+			self._entries.popitem(last=False)
+			self.evictions = self.evictions + 1
+
+
+	def invalidate(self, endpoint: str):
+
+		resource = self.resource(endpoint)
+
+		for key in list(self._entries.keys()):
+
+			cached_resource = self.resource(key[1])
+
+			if (
+				cached_resource == resource or
+				resource.startswith(f"{cached_resource}/") or
+				cached_resource.startswith(f"{resource}/")
+			):
+				del self._entries[key]
+				self.invalidations = self.invalidations + 1
+
+
+	def clear(self):
+
+		self._entries.clear()
+
+
+	def stats(self):
+
+		lookups = self.hits + self.misses
+
+		return {
+			"enabled": self.enabled,
+			"ttl": self.ttl,
+			"max_entries": self.max_entries,
+			"entries": len(self._entries),
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_ratio": round(self.hits / lookups, 4) if lookups else 0,
+			"evictions": self.evictions,
+			"invalidations": self.invalidations
+		}
+
+
+response_cache = ResponseCache(**(config.JamfPro_Prod.get("response_cache") or {}))
+
+
 async def api(method: str, endpoint: str, in_content_type: str = "json", out_content_type = "xml",
 	data: str | dict | None = None, api_token: str = API_TOKEN, username: str = API_USER,
-	password: str = API_PASSWORD):
+	password: str = API_PASSWORD, use_cache: bool = True):
+
+	cache_key = None
+
+	if method == "get" and use_cache and response_cache.enabled:
+
+		cache_key = response_cache.key(endpoint, in_content_type, (api_token, username, password))
+
+		if cached_response := response_cache.get(cache_key):
+			return cached_response
 
 	if api_token:
-		API_TOKEN = api_token
-		# API_TOKEN_EXPIRES = API_TOKEN_EXPIRES
+		response = await request(
+			method, endpoint, api_token, in_content_type, out_content_type, data)
+
 	else:
-		API_TOKEN, API_TOKEN_EXPIRES = await get_token(username, password)
 
-	# try:
-	# if API_TOKEN_EXPIRES:
-	# 	if datetime.now(timezone.utc) > (API_TOKEN_EXPIRES - timedelta(minutes=5)):
-	# 		log.debug("Renewing API Token...")
-	# 		API_TOKEN, API_TOKEN_EXPIRES = await core.jamf_pro.get_token()
-	# except:
-		# log.warning(f"Something is wrong with API_TOKEN_EXPIRES:  {API_TOKEN_EXPIRES}")
+		response = await request(method, endpoint,
+			await token_manager.get_token(username, password),
+			in_content_type, out_content_type, data)
 
+		if response is not False and response.status_code == 401:
+			# The cached API Token may have been invalidated server side
+			log.debug("Request was unauthorized; retrying with a new API Token...")
+			token_manager.invalidate(username, password)
+			response = await request(method, endpoint,
+				await token_manager.get_token(username, password),
+				in_content_type, out_content_type, data)
 
-	# log.debug(f"{API_TOKEN = }")
+	if cache_key and response is not False and response.status_code == 200:
+		response_cache.set(cache_key, response)
 
-	async with httpx.AsyncClient() as client:
+	elif method != "get":
+		response_cache.invalidate(endpoint)
 
-		match method:
+	return response
 
-			case "get":
 
-				return await client.get(
-					url = f"{JPS_URL}/{endpoint}",
-					headers = {
-						"Authorization": f"jamf-token {API_TOKEN}",
-						"Accept": f"application/{in_content_type}"
-					}
-				)
+class AdaptiveLimiter:
+	"""An AIMD (additive increase, multiplicative decrease) concurrency limiter.
 
-			case "post" | "create":
+	The number of concurrent requests allowed grows by roughly one for every `limit` healthy
+	responses and is cut by `decrease_factor` when an unhealthy response (e.g. throttled) is
+	received, at most once per `decrease_cooldown` seconds.
+	"""
 
-				return await client.post(
-					url = f"{JPS_URL}/{endpoint}",
-					headers = {
-						"Authorization": f"jamf-token {API_TOKEN}",
-						"Content_type": f"application/{out_content_type}"
-					},
-					data = data
-				)
+	def __init__(self, initial_concurrency: int = 10, min_concurrency: int = 1,
+		max_concurrency: int = 50, decrease_factor: float = 0.5, decrease_cooldown: float = 1.0):
 
-			case "put" | "update":
+		self.limit = float(initial_concurrency)
+		self.min_concurrency = min_concurrency
+		self.max_concurrency = max_concurrency
+		self.decrease_factor = decrease_factor
+		self.decrease_cooldown = decrease_cooldown
+		self.in_flight = 0
+		self.decreases = 0
+		self._last_decrease = 0
+		self._condition = None
+		self._loop = None
 
-				return await client.put(
-					url = f"{JPS_URL}/{endpoint}",
-					headers = {
-						"Authorization": f"jamf-token {API_TOKEN}",
-						"Content_type": f"application/{out_content_type}"
-					},
-					data = data
-				)
 
-			case "delete":
+	def _get_condition(self):
 
-				return await client.delete(
-					url = f"{JPS_URL}/{endpoint}",
-					headers = { "Authorization": f"jamf-token {API_TOKEN}" }
-				)
+		loop = asyncio.get_running_loop()
+
+		# Conditions are bound to the event loop they are first used in
+		if self._loop is not loop:
+			self._condition = asyncio.Condition()
+			self._loop = loop
+			self.in_flight = 0
+
+		return self._condition
+
+
+	async def acquire(self):
+
+		condition = self._get_condition()
+
+		async with condition:
+			await condition.wait_for(lambda: self.in_flight < max(int(self.limit), 1))
+			self.in_flight = self.in_flight + 1
+
+
+	async def release(self, healthy: bool = True):
+
+		condition = self._get_condition()
+
+		async with condition:
+
+			self.in_flight = max(self.in_flight - 1, 0)
+
+			if healthy:
+				self.limit = min(self.limit + 1 / self.limit, self.max_concurrency)
+
+			elif time.monotonic() - self._last_decrease > self.decrease_cooldown:
+				self.limit = max(self.limit * self.decrease_factor, self.min_concurrency)
+				self._last_decrease = time.monotonic()
+				self.decreases = self.decreases + 1
+				log.debug(f"Jamf Pro API concurrency limit decreased to:  {int(self.limit)}")
+
+			condition.notify_all()
+
+
+	def stats(self):
+
+		return {
+			"limit": int(self.limit),
+			"min_concurrency": self.min_concurrency,
+			"max_concurrency": self.max_concurrency,
+			"in_flight": self.in_flight,
+			"decreases": self.decreases
+		}
+
+
+class LatencyHistograms:
+	""" Request latency histograms, per method and endpoint (with IDs templated out). """
+
+	BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+	def __init__(self):
+
+		self._histograms = {}
+
+
+	@staticmethod
+	def template(method: str, endpoint: str):
+
+		endpoint = re.sub(r"/(id|name)/[^/]+", r"/\1/{\1}", ResponseCache.resource(endpoint))
+		return f"{method.upper()} {re.sub(r'/[0-9]+(?=/|$)', '/{id}', endpoint)}"
+
+
+	def observe(self, method: str, endpoint: str, seconds: float):
+
+		histogram = self._histograms.setdefault(
+			self.template(method, endpoint),
+			{ "count": 0, "sum": 0.0, "buckets": [0] * (len(self.BUCKETS) + 1) }
+		)
+		histogram["count"] = histogram["count"] + 1
+		histogram["sum"] = histogram["sum"] + seconds
+
+		for index, bucket in enumerate(self.BUCKETS):
+			if seconds <= bucket:
+				break
+		else:
+			index = len(self.BUCKETS)
+
+		histogram["buckets"][index] = histogram["buckets"][index] + 1
+
+
+	def stats(self):
+
+		return {
+			endpoint: {
+				"count": histogram["count"],
+				"sum": round(histogram["sum"], 4),
+				"average": round(histogram["sum"] / histogram["count"], 4),
+				# Cumulative counts of requests that completed in less than or equal to `le` seconds
+				"buckets": [
+					{ "le": bucket, "count": sum(histogram["buckets"][:index + 1]) }
+					for index, bucket in enumerate((*self.BUCKETS, "+Inf"))
+				]
+			}
+			for endpoint, histogram in self._histograms.items()
+		}
+
+
+rate_limit_config = config.JamfPro_Prod.get("rate_limit") or {}
+limiter = AdaptiveLimiter(
+	initial_concurrency = rate_limit_config.get("initial_concurrency", 10),
+	min_concurrency = rate_limit_config.get("min_concurrency", 1),
+	max_concurrency = rate_limit_config.get("max_concurrency", 50)
+)
+latency_histograms = LatencyHistograms()
+stats_config = config.JamfPro_Prod.get("stats") or {}
+stats_saved = 0
+RETRY_STATUS_CODES = { 429, 502, 503, 504 }
+# Responses where the request was not processed; safe to retry for any method
+RETRY_STATUS_CODES_NON_IDEMPOTENT = { 429, 503 }
+IDEMPOTENT_METHODS = { "get", "put", "update", "delete" }
+
+
+def process_name():
+
+	return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def stats():
+	"""Statistics of this process' Jamf Pro API client.
+
+	Returns:
+		dict:  The response cache, adaptive concurrency limiter and request latency statistics
+	"""
+
+	return {
+		"response_cache": response_cache.stats(),
+		"concurrency_limiter": limiter.stats(),
+		"latency": latency_histograms.stats()
+	}
+
+
+async def save_stats(force: bool = False):
+	"""Saves this process' statistics to the database, at most once per `stats.interval` seconds,
+	so that those of every process (i.e. the API and each Celery worker) can be reported.
+
+	Args:
+		force (bool, optional): Save regardless of when they were last saved. Defaults to False.
+	"""
+
+	global stats_saved
+
+	if not force and time.monotonic() - stats_saved < stats_config.get("interval", 30):
+		return
+
+	stats_saved = time.monotonic()
+
+	try:
+		await models.JamfProStats.update_or_create(
+			defaults={ "stats": stats() }, process=process_name())
+
+	except Exception as error:
+		log.debug(f"Failed to save Jamf Pro API client statistics:  {error!r}")
+
+
+async def get_stats():
+	"""Gets the saved statistics of each process' Jamf Pro API client, removing those of
+	processes that have not saved any within `stats.retention` seconds.
+
+	Returns:
+		dict:  The statistics of each process, keyed by `<hostname>:<pid>`
+	"""
+
+	await save_stats(force=True)
+	await models.JamfProStats.filter(last_update__lt=datetime.now(timezone.utc) - timedelta(
+		seconds=stats_config.get("retention", 86400))).delete()
+
+	return {
+		process.process: { "last_update": process.last_update, **process.stats }
+		for process in await models.JamfProStats.all().order_by("process")
+	}
+
+
+async def retry_delay(attempt: int, response: httpx.Response | None = None):
+	"""Determines how long to wait before retrying a request, honoring a `Retry-After` header,
+	otherwise using exponential backoff with full jitter.
+
+	Args:
+		attempt (int): The number of the attempt that failed, starting at zero
+		response (httpx.Response | None): The response to the failed attempt, if any
+
+	Returns:
+		float: Seconds to wait
+	"""
+
+	backoff_max = rate_limit_config.get("backoff_max", 30)
+
+	if response is not None and (retry_after := response.headers.get("Retry-After")):
+
+		try:
+			return min(float(retry_after), backoff_max)
+
+		except ValueError:
+
+			try:
+				return min(max(
+					(parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds(),
+					0
+				), backoff_max)
+
+			except (TypeError, ValueError):
+				log.debug(f"Unable to parse Retry-After header:  {retry_after}")
+
+	return random.uniform(
+		0, min(backoff_max, rate_limit_config.get("backoff_base", 0.5) * 2 ** attempt))
+
+
+async def request(method: str, endpoint: str, api_token: str, in_content_type: str = "json",
+	out_content_type = "xml", data: str | dict | None = None):
+	"""Sends a request to the Jamf Pro API through the adaptive concurrency limiter, retrying
+	throttled or unavailable (429/502/503/504) responses and connection errors.
+
+	Non-idempotent requests (e.g. POST) are only retried when Jamf Pro did not process them:
+	429/503 responses and connection errors raised before the request was sent.
+	"""
+
+	max_retries = rate_limit_config.get("max_retries", 5)
+
+	# Only idempotent requests are retried if the request may have been received
+	retry_exceptions = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+	retry_status_codes = RETRY_STATUS_CODES_NON_IDEMPOTENT
+
+	if method in IDEMPOTENT_METHODS:
+		retry_exceptions = (httpx.TransportError,)
+		retry_status_codes = RETRY_STATUS_CODES
+
+	for attempt in range(max_retries + 1):
+
+		response = None
+		await limiter.acquire()
+		start = time.monotonic()
+
+		try:
+			response = await send_request(
+				method, endpoint, api_token, in_content_type, out_content_type, data)
+
+		except retry_exceptions as error:
+
+			if attempt == max_retries:
+				raise
+
+			log.debug(f"Request to {endpoint} failed:  {error!r}")
+
+		finally:
+			latency_histograms.observe(method, endpoint, time.monotonic() - start)
+			await limiter.release(
+				response is not None and response is not False and
+				response.status_code not in RETRY_STATUS_CODES
+			)
+			await save_stats()
+
+		if response is False or (
+			response is not None and
+			(response.status_code not in retry_status_codes or attempt == max_retries)
+		):
+			return response
+
+		delay = await retry_delay(attempt, response)
+		log.debug(
+			f"Retrying request to {endpoint} in {delay:.2f} seconds "
+			f"(attempt {attempt + 1} of {max_retries})"
+		)
+		await asyncio.sleep(delay)
+
+
+async def send_request(method: str, endpoint: str, api_token: str, in_content_type: str = "json",
+	out_content_type = "xml", data: str | dict | None = None):
+
+	client = http_client.get()
+
+	match method:
+
+		case "get":
+
+			return await client.get(
+				url = endpoint,
+				headers = {
+					"Authorization": f"jamf-token {api_token}",
+					"Accept": f"application/{in_content_type}"
+				}
+			)
+
+		case "post" | "create":
+
+			return await client.post(
+				url = endpoint,
+				headers = {
+					"Authorization": f"jamf-token {api_token}",
+					"Content_type": f"application/{out_content_type}"
+				},
+				data = data
+			)
+
+		case "put" | "update":
+
+			return await client.put(
+				url = endpoint,
+				headers = {
+					"Authorization": f"jamf-token {api_token}",
+					"Content_type": f"application/{out_content_type}"
+				},
+				data = data
+			)
+
+		case "delete":
+
+			return await client.delete(
+				url = endpoint,
+				headers = { "Authorization": f"jamf-token {api_token}" }
+			)
 
 	return False
 
 
+async def get_packages(page_size: int = 1000):
+	"""Get all Packages from Jamf Pro.
+
+	Uses the Jamf Pro API (which includes the file name and size) when available, otherwise
+	the Classic API.
+
+	Returns:
+		list: Packages (in dicts, with their `id`, `name`, and if available, `file_name` and `size`)
+	"""
+
+	packages = []
+	page = 0
+
+	while True:
+
+		response = await api("get",
+			f"api/v1/packages?page={page}&page-size={page_size}&sort=id%3Aasc", use_cache=False)
+
+		if response.status_code != 200:
+			break
+
+		response_json = response.json()
+
+		for package in response_json.get("results"):
+
+			try:
+				size = int(package.get("size"))
+			except (TypeError, ValueError):
+				size = None
+
+			packages.append({
+				"id": int(package.get("id")),
+				"name": package.get("packageName"),
+				"file_name": package.get("fileName"),
+				"size": size
+			})
+
+		page = page + 1
+
+		if page * page_size >= response_json.get("totalCount", 0):
+			return packages
+
+	log.debug("The Jamf Pro API Packages endpoint is unavailable; using the Classic API")
+	response = await api("get", "JSSResource/packages", use_cache=False)
+
+	if response.status_code != 200:
+		raise Exception("Failed to get list of Packages!")
+
+	return [
+		{ "id": package.get("id"), "name": package.get("name"), "file_name": None, "size": None }
+		for package in response.json().get("packages")
+	]
+
+
+async def get_policy(policy_id: int, subsets: tuple | None = POLICY_SUBSETS,
+	in_content_type: str = "json", use_cache: bool = True):
+	"""Get a Policy's details, optionally limited to only the specified subsets.
+
+	Args:
+		policy_id (int): The Policy ID
+		subsets (tuple | None): Subsets of the Policy to request (e.g. `General`, `Packages`,
+			`Scope`, `SelfService`); if None, the entire Policy is requested
+		in_content_type (str): `json` or `xml`
+		use_cache (bool): Whether a cached response may be returned
+
+	Returns:
+		httpx.Response: The response from Jamf Pro
+	"""
+
+	endpoint = f"JSSResource/policies/id/{policy_id}"
+
+	if subsets:
+		endpoint = f"{endpoint}/subset/{'&'.join(subsets)}"
+
+	return await api("get", endpoint, in_content_type=in_content_type, use_cache=use_cache)
+
+
+async def parse_policy(policy_details: dict):
+	"""Parses only the Policy attributes that PkgBot caches from the details of a Policy,
+	as returned from either the full Policy or the `General&Packages` subsets.
+
+	Args:
+		policy_details (dict): The Policy details as returned from Jamf Pro
+
+	Returns:
+		dict: The Policy's `policy_id`, `name`, `site` and `packages` (names)
+	"""
+
+	policy_general = policy_details.get("policy", {}).get("general", {})
+	policy_packages = policy_details.get("policy", {}).get(
+		"package_configuration", {}).get("packages", [])
+
+	return {
+		"policy_id": policy_general.get("id"),
+		"name": policy_general.get("name"),
+		"site": (policy_general.get("site") or {}).get("name"),
+		"packages": [ package.get("name") for package in policy_packages ]
+	}
+
+
+async def webhook_handler(payload: dict):
+	"""Handles Jamf Pro webhook events that affect cached Policies and Packages.
+
+	Jamf Pro only sends events for Policies and Packages when they are modified via the API,
+	i.e. `RestAPIOperation` events.
+
+	Args:
+		payload (dict): The Jamf Pro webhook payload
+	"""
+
+	webhook_event = payload.get("webhook", {}).get("webhookEvent")
+	event = payload.get("event", {})
+	object_type = event.get("objectTypeName")
+	operation = (event.get("restAPIOperationType") or "").upper()
+
+	log.debug(f"Received Jamf Pro webhook:  {webhook_event} | {object_type} | {operation}")
+
+	if (
+		webhook_event != "RestAPIOperation" or
+		not event.get("operationSuccessful") or
+		operation not in { "POST", "PUT", "DELETE" }
+	):
+		return
+
+	match object_type:
+
+		case "Policy":
+			await core.policy.queue_change("policy", event.get("objectID"), operation == "DELETE")
+
+		case "Package" if operation == "DELETE":
+			await core.policy.queue_change("package", event.get("objectName"), True)
+
+		case "Package":
+			# Created or updated (e.g. renamed); refreshed by ID
+			await core.policy.queue_change("package_id", event.get("objectID"))
+
+
 async def get_packages_from_policy(policy_object: str, content_type: str = "xml"):
 	# Get the packages currently in the Policy configuration
 
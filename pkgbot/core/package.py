@@ -1,8 +1,17 @@
+import collections
+
 from celery import current_app as pkgbot_celery_app
 
+from tortoise.functions import Count
+from tortoise.transactions import in_transaction
+
 from pkgbot import core
 from pkgbot.db import models, schemas
 from pkgbot.tasks import task
+from pkgbot.utilities import common as utility
+
+
+log = utility.log
 
 
 async def get(package_filter: dict | None = None):
@@ -65,6 +74,11 @@ async def delete_hold(pkg_note_object: dict):
 async def update(package_filter: dict, updates: dict):
 
 	await models.Packages.filter(**package_filter).update(**updates)
+
+	if updates.keys() & { "name", "pkg_name", "version" }:
+		for pkg_object in await models.Packages.filter(**package_filter):
+			await pkg_object.save(update_fields=("software_title", "version_key"))
+
 	return await get({ "id": package_filter.get("id") })
 
 
@@ -126,3 +140,189 @@ async def package_cleanup(kwargs: dict | None = None):
 		queue = "pkgbot",
 		priority = 3
 	)
+
+
+async def sync_jamf_pkgs(chunk_size: int = 500):
+	"""Syncs the local mirror of Jamf Pro Packages; only new, changed
+	and deleted Packages are written.
+
+	Returns:
+		dict: Number of Packages `created`, `updated` and `deleted`
+	"""
+
+	jamf_pkgs = { pkg.get("id"): pkg for pkg in await core.jamf_pro.get_packages() }
+	cached_pkgs = { pkg.id: pkg for pkg in await models.JamfPackages.all() }
+	new_pkgs = []
+	changed_pkgs = []
+
+	for pkg_id, pkg in jamf_pkgs.items():
+
+		cached_pkg = cached_pkgs.get(pkg_id)
+		software_title, version = await utility.parse_pkg_name(pkg.get("name"))
+
+		if (
+			cached_pkg and cached_pkg.name == pkg.get("name") and
+			cached_pkg.software_title == software_title and
+			cached_pkg.file_name == pkg.get("file_name") and cached_pkg.size == pkg.get("size") and
+			# e.g. the version key format changed
+			cached_pkg.version_key == await utility.version_key(version)
+		):
+			continue
+
+		pkg_details = {
+			"name": pkg.get("name"),
+			"file_name": pkg.get("file_name"),
+			"software_title": software_title,
+			"version": version,
+			"version_key": await utility.version_key(version),
+			"size": pkg.get("size")
+		}
+
+		if cached_pkg:
+			changed_pkgs.append(cached_pkg.update_from_dict(pkg_details))
+		else:
+			new_pkgs.append(models.JamfPackages(id=pkg_id, **pkg_details))
+
+	deleted_pkg_ids = [ pkg_id for pkg_id in cached_pkgs.keys() if pkg_id not in jamf_pkgs ]
+
+	async with in_transaction() as connection:
+
+		if new_pkgs:
+			await models.JamfPackages.bulk_create(
+				new_pkgs, batch_size=chunk_size, using_db=connection)
+
+		if changed_pkgs:
+			await models.JamfPackages.bulk_update(changed_pkgs,
+				fields=["name", "file_name", "software_title", "version", "version_key", "size"],
+				batch_size=chunk_size, using_db=connection)
+
+		for index in range(0, len(deleted_pkg_ids), chunk_size):
+			await models.JamfPackages.filter(
+				id__in=deleted_pkg_ids[index:index + chunk_size]).using_db(connection).delete()
+
+	results = { "created": len(new_pkgs), "updated": len(changed_pkgs), "deleted": len(deleted_pkg_ids) }
+	log.debug(f"Synced Jamf Pro Packages:  {results}")
+	return results
+
+
+async def get_jamf_pkgs_to_cleanup(versions_to_keep: int, max_allowed_pkgs_to_delete: int | None,
+	chunk_size: int = 500):
+	"""Get the Jamf Pro Packages of each software title that has more than `versions_to_keep`
+	versions, excluding the newest `versions_to_keep` versions.
+
+	Packages without a version key (i.e. their version could not be determined) cannot be ordered
+	and are neither counted nor deleted.
+
+	Args:
+		versions_to_keep (int): Number of versions of each software title to keep
+		max_allowed_pkgs_to_delete (int | None): Maximum number of Packages per software title
+		chunk_size (int): Maximum number of software titles per query
+
+	Returns:
+		dict: Packages (models.JamfPackages) to delete, keyed by software title
+	"""
+
+	titles = await models.JamfPackages.filter(version_key__isnull=False).annotate(
+		count=Count("id")).group_by("software_title").filter(
+		count__gt=versions_to_keep).values_list("software_title", flat=True)
+	pkgs = collections.defaultdict(list)
+
+	for titles_chunk in core.policy.chunk(titles, chunk_size):
+		for pkg in await models.JamfPackages.filter(software_title__in=titles_chunk,
+			version_key__isnull=False).order_by("software_title", "version_key", "id"):
+			pkgs[pkg.software_title].append(pkg)
+
+	pkgs_to_delete = {}
+
+	for software_title, title_pkgs in pkgs.items():
+
+		title_pkgs = title_pkgs[:len(title_pkgs) - versions_to_keep]
+
+		if max_allowed_pkgs_to_delete and len(title_pkgs) > max_allowed_pkgs_to_delete:
+			log.debug(
+				f"{software_title}:  Found {len(title_pkgs)} packages.  "
+				f"Maximum allowed is {max_allowed_pkgs_to_delete}.  "
+				"Override by setting the 'maximum_allowed_packages_to_delete' argument."
+			)
+
+		pkgs_to_delete[software_title] = title_pkgs[:max_allowed_pkgs_to_delete]
+
+	return pkgs_to_delete
+
+
+async def delete_jamf_pkgs(pkg_filter: dict):
+
+	return await models.JamfPackages.filter(**pkg_filter).delete()
+
+
+async def get_cleanup_report(jamf_pkgs: list, chunk_size: int = 500):
+	"""Builds the Package Cleanup report rows for the passed Jamf Pro Packages.
+
+	Only the fields included in the report are loaded, for all Packages at once
+	(per chunk of Package names), and whether a Package is in use is determined
+	by counting its rows in the Policy relationship tables.
+
+	Args:
+		jamf_pkgs (list): Packages (models.JamfPackages) to report on
+		chunk_size (int): Number of Package names per query
+
+	Returns:
+		dict: Report rows keyed by Package name
+	"""
+
+	pkg_names = [ pkg.name for pkg in jamf_pkgs ]
+	pkgs = {}
+	holds = collections.defaultdict(list)
+	policies = collections.defaultdict(list)
+	policy_counts = collections.Counter()
+
+	for index in range(0, len(pkg_names), chunk_size):
+		names = pkg_names[index:index + chunk_size]
+
+		for pkg in await models.Packages.filter(pkg_name__in=names).values(
+			"id", "name", "version", "pkg_name", "packaged_date", "promoted_date",
+			"last_update", "status", "updated_by"
+		):
+			pkgs[pkg.get("pkg_name")] = pkg
+
+		for pkg in await models.PackagesManual.filter(
+			pkg_name__in=[ name for name in names if name not in pkgs ]
+		).values("id", "name", "version", "pkg_name", "status"):
+			pkgs[pkg.get("pkg_name")] = pkg
+
+		for hold in await models.PackageHold.filter(package_id__in=names).values(
+			"package_id", "enabled", "site", "submitted_by"):
+			holds[hold.pop("package_id")].append(hold)
+
+		for pkg_model, relation in (
+			(models.Packages, "packages"), (models.PackagesManual, "packages_manual")
+		):
+
+			for pkg in await pkg_model.filter(pkg_name__in=names).annotate(
+				policy_count=Count("policies")).filter(policy_count__gt=0).values(
+				"pkg_name", "policy_count"):
+				policy_counts[pkg.get("pkg_name")] += pkg.get("policy_count")
+
+			for policy in await models.Policies.filter(
+				**{ f"{relation}__pkg_name__in": names }).values(
+				"policy_id", "name", "site", pkg_name=f"{relation}__pkg_name"):
+				policies[policy.pop("pkg_name")].append(policy)
+
+	report = {}
+
+	for jamf_pkg in jamf_pkgs:
+
+		if pkg := pkgs.get(jamf_pkg.name):
+			report[jamf_pkg.name] = {
+				**pkg,
+				"holds": holds.get(jamf_pkg.name),
+				"policies": policies.get(jamf_pkg.name),
+				"policy_count": policy_counts.get(jamf_pkg.name, 0)
+			}
+		else:
+			report[jamf_pkg.name] = {
+				"id": jamf_pkg.id, "name": jamf_pkg.name, "version": jamf_pkg.version,
+				"policy_count": 0
+			}
+
+	return report
@@ -1,3 +1,6 @@
+import asyncio
+import hashlib
+import json
 import re
 
 from xml.etree import ElementTree
@@ -5,6 +8,7 @@ from xml.etree import ElementTree
 from celery import current_app as pkgbot_celery_app
 
 from tortoise.expressions import Q
+from tortoise.transactions import in_transaction
 
 from pkgbot import config, core
 from pkgbot.db import models, schemas
@@ -13,6 +17,8 @@ from pkgbot.utilities import common as utility
 
 config = config.load_config()
 log = utility.log
+pending_changes = { "policy": {}, "package": {}, "package_id": {} }
+pending_changes_task = None
 
 
 async def get(policy_filter: dict | Q | None = None):
@@ -33,6 +39,7 @@ async def create_or_update(policy_object: schemas.Policy_In):
 		defaults = {
 			"name": policy_object.dict().get("name"),
 			"site": policy_object.dict().get("site"),
+			"fingerprint": policy_object.dict().get("fingerprint"),
 		},
 		policy_id = policy_object.dict().get("policy_id")
 	)
@@ -44,27 +51,324 @@ async def delete(policy_filter: dict):
 	return await policy_obj.delete()
 
 
-async def cache_policies(source: str | None = None, called_by: str | None = None):
+async def fingerprint(name: str, site: str, packages: list):
+	"""Computes a fingerprint of the Policy attributes that are cached.
+
+	Args:
+		name (str): Name of the Policy
+		site (str): Site the Policy belongs to
+		packages (list): Names of the Packages in the Policy
+
+	Returns:
+		str: sha256 hex digest
+	"""
+
+	return hashlib.sha256(
+		json.dumps(
+			{ "name": name, "site": site, "packages": sorted(packages) }, sort_keys=True
+		).encode("UTF-8")
+	).hexdigest()
+
+
+async def parse_policy_details(policy_details: dict):
+	"""Parses the Policy attributes that are cached from a Policy's details.
+
+	Args:
+		policy_details (dict): The Policy details as returned from Jamf Pro
+
+	Returns:
+		dict: The Policy's `policy_id`, `name`, `site`, `packages` (names) and `fingerprint`
+	"""
+
+	policy = await core.jamf_pro.parse_policy(policy_details)
+	policy["fingerprint"] = await fingerprint(policy["name"], policy["site"], policy["packages"])
+
+	return policy
+
+
+async def manual_pkg_details(pkg_name: str):
+
+	try:
+		version = re.sub(r"\.(pkg|dmg)", "", pkg_name.rsplit("-", 1)[1])
+	except:
+		version = "1.0"
+
+	return {
+		"name": pkg_name.rsplit("-", 1)[0],
+		"pkg_name": pkg_name,
+		"version": version,
+		"status": "prod"
+	}
+
+
+async def get_pkg_ids():
+	"""Get the ids of all PkgBot and manually uploaded Packages, keyed by their `pkg_name`.
+
+	Returns:
+		tuple(dict, dict): PkgBot Packages, manually uploaded Packages
+	"""
+
+	return (
+		dict(await models.Packages.all().values_list("pkg_name", "id")),
+		dict(await models.PackagesManual.all().values_list("pkg_name", "id"))
+	)
+
+
+def chunk(items: list, size: int):
+
+	items = list(items)
+
+	for index in range(0, len(items), size):
+		yield items[index:index + size]
+
+
+async def cache_batch(policies: list, pkg_ids: dict, manual_pkg_ids: dict, chunk_size: int = 500):
+	"""Creates or updates a batch of cached Policies and their Package relationships in a
+	single transaction.
+
+	The relationship tables are diffed against the desired relationships so that only the
+	added and removed rows are written.
+
+	Args:
+		policies (list): Policies as returned from `parse_policy_details`
+		pkg_ids (dict): PkgBot Package ids, keyed by `pkg_name`
+		manual_pkg_ids (dict): Manually uploaded Package ids, keyed by `pkg_name`; updated
+			in place with any Packages that are created
+		chunk_size (int): Maximum number of rows per bulk statement
+	"""
+
+	policy_ids = [ policy.get("policy_id") for policy in policies ]
+
+	async with in_transaction() as connection:
+
+		cached_policies = {}
+
+		for policy_ids_chunk in chunk(policy_ids, chunk_size):
+			cached_policies |= {
+				policy_obj.policy_id: policy_obj
+				for policy_obj in await models.Policies.filter(
+					policy_id__in=policy_ids_chunk).using_db(connection)
+			}
+
+		new_policies = []
+
+		for policy in policies:
+
+			if policy_obj := cached_policies.get(policy.get("policy_id")):
+				policy_obj.name = policy.get("name")
+				policy_obj.site = policy.get("site")
+				policy_obj.fingerprint = policy.get("fingerprint")
+
+			else:
+				new_policies.append(models.Policies(
+					policy_id = policy.get("policy_id"),
+					name = policy.get("name"),
+					site = policy.get("site"),
+					fingerprint = policy.get("fingerprint")
+				))
+
+		if cached_policies:
+			await models.Policies.bulk_update(list(cached_policies.values()),
+				fields=["name", "site", "fingerprint"], batch_size=chunk_size, using_db=connection)
+
+		if new_policies:
+			await models.Policies.bulk_create(
+				new_policies, batch_size=chunk_size, using_db=connection)
+
+		policy_pks = {}
+
+		for policy_ids_chunk in chunk(policy_ids, chunk_size):
+			policy_pks |= dict(await models.Policies.filter(policy_id__in=policy_ids_chunk
+				).using_db(connection).values_list("policy_id", "id"))
+
+		# Manually uploaded Packages that are not yet known
+		if unknown_pkgs := {
+			pkg_name
+			for policy in policies
+			for pkg_name in policy.get("packages")
+			if pkg_name not in pkg_ids and pkg_name not in manual_pkg_ids
+		}:
+			new_manual_pkgs = [
+				models.PackagesManual(**await manual_pkg_details(pkg_name))
+				for pkg_name in unknown_pkgs
+			]
+
+			# bulk_create does not call save()
+			for pkg_object in new_manual_pkgs:
+				await models.set_version_fields(pkg_object)
+
+			await models.PackagesManual.bulk_create(
+				new_manual_pkgs, batch_size=chunk_size, using_db=connection)
+
+			for pkg_names_chunk in chunk(unknown_pkgs, chunk_size):
+				manual_pkg_ids |= dict(await models.PackagesManual.filter(
+					pkg_name__in=pkg_names_chunk).using_db(connection).values_list("pkg_name", "id"))
+
+		for model, ids in (
+			(models.Packages, pkg_ids),
+			(models.PackagesManual, { pkg_name: id for pkg_name, id in manual_pkg_ids.items()
+				if pkg_name not in pkg_ids })
+		):
+
+			m2m_field = model._meta.fields_map.get("policies")
+			desired_rows = {
+				(ids.get(pkg_name), policy_pks.get(policy.get("policy_id")))
+				for policy in policies
+				for pkg_name in policy.get("packages")
+				if pkg_name in ids
+			}
+			current_rows = set()
+
+			for policy_pks_chunk in chunk(policy_pks.values(), chunk_size):
+				_, rows = await connection.execute_query(
+					f"SELECT {m2m_field.backward_key}, {m2m_field.forward_key} "
+					f"FROM {m2m_field.through} WHERE {m2m_field.forward_key} "
+					f"IN ({', '.join('?' * len(policy_pks_chunk))})",
+					policy_pks_chunk
+				)
+				current_rows |= { tuple(row) for row in rows }
+
+			for rows_chunk in chunk(current_rows - desired_rows, chunk_size):
+				await connection.execute_many(
+					f"DELETE FROM {m2m_field.through} WHERE "
+					f"{m2m_field.backward_key} = ? AND {m2m_field.forward_key} = ?",
+					rows_chunk
+				)
+
+			for rows_chunk in chunk(desired_rows - current_rows, chunk_size):
+				await connection.execute_many(
+					f"INSERT INTO {m2m_field.through} "
+					f"({m2m_field.backward_key}, {m2m_field.forward_key}) VALUES (?, ?)",
+					rows_chunk
+				)
+
+
+async def cache_policies(
+	source: str | None = None, called_by: str | None = None, mode: str = "full"):
 
 	return pkgbot_celery_app.send_task(
 		"pkgbot:cache_policies",
 		kwargs = {
 			"source": source,
-			"called_by": called_by
+			"called_by": called_by,
+			"mode": mode
 		},
 		queue="pkgbot",
 		priority=3
 	)
 
 
+async def queue_change(object_type: str, object_id: int | str, deleted: bool = False):
+	"""Queues a change to a cached Policy (by Policy ID) or Package (by name when deleted,
+	otherwise by Package ID).
+
+	Changes are collected for `webhook_debounce` seconds and then passed to a single
+	`pkgbot:update_policies` task so that bursts of changes are coalesced.
+
+	Args:
+		object_type (str): `policy`, `package` (deleted) or `package_id` (created or updated)
+		object_id (int | str): The Policy ID, Package name or Package ID
+		deleted (bool): Whether the object was deleted
+	"""
+
+	global pending_changes_task
+
+	pending_changes[object_type][object_id] = deleted
+
+	if pending_changes_task is None or pending_changes_task.done():
+		pending_changes_task = asyncio.create_task(flush_changes())
+
+
+async def flush_changes():
+	"""Queues a `pkgbot:update_policies` task for the pending changes after waiting
+	`webhook_debounce` seconds.
+
+	The changes are only removed from the pending changes once the task has been queued; if
+	queuing fails, they are kept and the flush is rescheduled.
+	"""
+
+	global pending_changes_task
+
+	await asyncio.sleep((config.PkgBot.get("Policy_Cache") or {}).get("webhook_debounce", 10))
+
+	changes = {
+		object_type: dict(object_changes) for object_type, object_changes in pending_changes.items()
+	}
+
+	log.debug(
+		f"Updating {len(changes['policy'])} Policies and "
+		f"{len(changes['package']) + len(changes['package_id'])} Packages from Jamf Pro webhook events"
+	)
+
+	try:
+		queued_task = await asyncio.to_thread(
+			pkgbot_celery_app.send_task,
+			"pkgbot:update_policies",
+			kwargs = {
+				"policy_ids": [ id for id, deleted in changes["policy"].items() if not deleted ],
+				"deleted_policy_ids": [ id for id, deleted in changes["policy"].items() if deleted ],
+				"deleted_pkg_names": list(changes["package"].keys()),
+				"pkg_ids": list(changes["package_id"].keys())
+			},
+			queue="pkgbot",
+			priority=4
+		)
+
+	except Exception as error:
+		log.error(f"Failed to queue the update of cached Policies and Packages:  {error!r}")
+		pending_changes_task = asyncio.create_task(flush_changes())
+		return None
+
+	for object_type, object_changes in changes.items():
+		for object_id, deleted in object_changes.items():
+			# Unless it changed again while the task was being queued
+			if pending_changes[object_type].get(object_id) == deleted:
+				del pending_changes[object_type][object_id]
+
+	if any(pending_changes.values()):
+		# Changes that were queued while the task was being queued
+		pending_changes_task = asyncio.create_task(flush_changes())
+
+	return queued_task
+
+
+async def get_policy_ids_by_pkg_names(pkg_names: list | set, chunk_size: int = 500):
+	"""Get the IDs of the cached Policies that contain any of the passed Packages.
+
+	Args:
+		pkg_names (list | set): Names of PkgBot or manually uploaded Packages
+		chunk_size (int): Maximum number of Package names per query
+
+	Returns:
+		set: Policy IDs
+	"""
+
+	policy_ids = set()
+
+	for pkg_names_chunk in chunk(pkg_names, chunk_size):
+		policy_ids |= set(await models.Policies.filter(
+			Q(packages__pkg_name__in=pkg_names_chunk) |
+			Q(packages_manual__pkg_name__in=pkg_names_chunk)
+		).distinct().values_list("policy_id", flat=True))
+
+	return policy_ids
+
+
+async def delete_manual_pkgs(pkg_names: list):
+
+	# Relationships are not removed by a bulk delete
+	for pkg_object in await models.PackagesManual.filter(pkg_name__in=pkg_names):
+		await pkg_object.policies.clear()
+
+	return await models.PackagesManual.filter(pkg_name__in=pkg_names).delete()
+
+
 async def update_policy(policy_object, pkg_object, username, trigger_id):
 
 	log.debug(f"Getting details for Policy ID:  {policy_object.policy_id}")
-	policy_xml_response  = await core.jamf_pro.api(
-		"get",
-		f"JSSResource/policies/id/{policy_object.policy_id}",
-		in_content_type = "xml",
-	)
+	# The Policy is written back, so it must not be read from the (per process) response cache
+	policy_xml_response = await core.jamf_pro.get_policy(
+		policy_object.policy_id, subsets = ("Packages",), in_content_type = "xml", use_cache = False)
 
 	if policy_xml_response.status_code != 200:
 		raise(f"Failed to get policy details for:  {policy_object.policy_id}:{policy_object.name}!")
@@ -74,16 +378,17 @@ async def update_policy(policy_object, pkg_object, username, trigger_id):
 	log.debug(f"Current Policy Packages:  {current_packages}")
 	log.debug(f"New Package to Add:  {pkg_object.pkg_name}")
 
-	pkg_name = pkg_object.pkg_name.split("-", 1)[0]
-	pkg_name = re.sub(r"\s\((Universal|Intel|ARM)\)", "", pkg_name)
-	pkg_name = re.sub(r"\s", "[ _-]", pkg_name)
+	software_title = (
+		pkg_object.software_title or (await utility.parse_pkg_name(pkg_object.pkg_name))[0])
+	packages = []
 
 	for pkg in current_packages:
-		if re.search(pkg_name, pkg.get("name")):
+		if (await utility.parse_pkg_name(pkg.get("name")))[0] == software_title:
 			log.debug(f"Removing package:  {pkg.get('name')}")
-			current_packages.remove(pkg)
-		pkg |= {"action": "Install"}
+		else:
+			packages.append(pkg | {"action": "Install"})
 
+	current_packages = packages
 	current_packages.append({"name": pkg_object.pkg_name, "action": "Install"})
 	log.debug(f"Packages to add to Policy:  {current_packages}")
 
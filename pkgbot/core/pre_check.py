@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta, timezone
+
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import Q
+
+from pkgbot import config
+from pkgbot.db import models
+
+
+config = config.load_config()
+
+
+def freshness_window():
+
+	return timedelta(seconds=config.AutoPkg.get("pre_check_freshness", 300))
+
+
+def refresh_timeout():
+
+	return timedelta(seconds=config.AutoPkg.get("pre_check_timeout", 1800))
+
+
+async def get(names: list):
+
+	return { pre_check.name: pre_check for pre_check in
+		await models.PreChecks.filter(name__in=names) }
+
+
+async def claim(name: str, task_id: str):
+	"""Claims the refresh of a pre-check, unless it passed within the freshness window
+	or another refresh is already in progress.
+
+	The claim is a single conditional UPDATE, so only one caller can claim a refresh.
+
+	Args:
+		name (str): Name of the pre-check
+		task_id (str): task_id of the claiming task
+
+	Returns:
+		str:  `fresh` if a passing result can be reused, `claimed` if the caller
+			should perform the pre-check, or `pending` if another refresh is in progress
+	"""
+
+	now = datetime.now(timezone.utc)
+
+	try:
+		await models.PreChecks.get_or_create(name=name)
+	except IntegrityError:
+		pass
+
+	if await models.PreChecks.filter(
+		name=name, status="success", last_update__gte=now - freshness_window()).exists():
+		return "fresh"
+
+	if await models.PreChecks.filter(
+		Q(status__isnull=True) | Q(status="failed") |
+		Q(status="success", last_update__lt=now - freshness_window()) |
+		Q(status="running", last_update__lt=now - refresh_timeout()),
+		name=name
+	).update(status="running", task_id=task_id, last_update=now):
+		return "claimed"
+
+	return "pending"
+
+
+async def record(name: str, success: bool, task_id: str):
+
+	await models.PreChecks.filter(name=name).update(
+		status="success" if success else "failed",
+		task_id=task_id,
+		last_update=datetime.now(timezone.utc)
+	)
+
+
+async def release(names: list, task_id: str, failed_task_id: str):
+	"""Fails the pre-checks claimed by `task_id` whose results were never recorded (e.g. a
+	pre-check raised), so that they can be claimed again.
+
+	Args:
+		names (list): Names of the pre-checks claimed by the task
+		task_id (str): task_id of the claiming task
+		failed_task_id (str): task_id of the task that failed
+	"""
+
+	await models.PreChecks.filter(name__in=names, status="running", task_id=task_id).update(
+		status="failed",
+		task_id=failed_task_id,
+		last_update=datetime.now(timezone.utc)
+	)
+
+
+async def is_stale(pre_check: models.PreChecks):
+
+	return pre_check.last_update < datetime.now(timezone.utc) - refresh_timeout()
@@ -0,0 +1,475 @@
+import asyncio
+import glob
+import hashlib
+import os
+import plistlib
+import time
+
+import git
+import yaml
+
+from pkgbot import config
+from pkgbot.db import models
+from pkgbot.tasks import task_utils
+from pkgbot.utilities import common as utility
+
+
+config = config.load_config()
+log = utility.log
+RECIPE_EXTENSIONS = (".recipe", ".recipe.plist", ".recipe.yaml")
+recipe_index = { "built": 0, "paths": {} }
+override_index = { "built": 0, "paths": {} }
+
+
+async def get_autopkg_prefs():
+
+	try:
+		return await utility.plist_reader(
+			os.path.abspath(config.JamfPro_Dev.get("autopkg_prefs")))
+	except Exception:
+		return {}
+
+
+def expand_user(path: str):
+	"""Expands `~` against the home directory of the user AutoPkg runs as, instead of that of
+	the user PkgBot is running as.
+	"""
+
+	if (path == "~" or path.startswith("~/")) and (
+		home := task_utils.get_run_as().get("env", {}).get("HOME")):
+		return f"{home}{path[1:]}"
+
+	return os.path.expanduser(path)
+
+
+async def get_override_dirs():
+
+	if override_dir := config.AutoPkg.get("recipe_overrides"):
+		override_dirs = [ override_dir ]
+	else:
+		override_dirs = (await get_autopkg_prefs()).get(
+			"RECIPE_OVERRIDE_DIRS", [ "~/Library/AutoPkg/RecipeOverrides" ])
+
+	if isinstance(override_dirs, str):
+		override_dirs = [ override_dirs ]
+
+	return [ expand_user(override_dir) for override_dir in override_dirs ]
+
+
+def read_recipe(path: str):
+
+	with open(path, "rb") as recipe_file:
+
+		if path.endswith(".yaml"):
+			return yaml.safe_load(recipe_file)
+
+		return plistlib.load(recipe_file)
+
+
+async def load_recipe(path: str):
+	"""Loads a (plist or yaml) recipe or override."""
+
+	return read_recipe(path)
+
+
+async def get_override_index():
+	"""Get the path of every override in the override directories, keyed by identifier.
+
+	The index is rebuilt after `AutoPkg.recipe_index_ttl` seconds or when it is invalidated.
+
+	Returns:
+		dict:  Paths of overrides, keyed by their identifier
+	"""
+
+	if time.monotonic() - override_index["built"] < config.AutoPkg.get("recipe_index_ttl", 600):
+		return override_index["paths"]
+
+	paths = [
+		os.path.join(root, file)
+		for override_dir in await get_override_dirs()
+		for root, _, files in os.walk(override_dir)
+		for file in files
+		if file.endswith(RECIPE_EXTENSIONS)
+	]
+	identifiers = await asyncio.gather(
+		*[ asyncio.to_thread(get_identifier, path) for path in paths ])
+	index = {}
+
+	for path, identifier in zip(paths, identifiers):
+		if identifier and identifier not in index:
+			index[identifier] = path
+
+	override_index.update({ "built": time.monotonic(), "paths": index })
+	log.debug(f"Indexed {len(index)} overrides")
+	return index
+
+
+def invalidate_override_index():
+
+	override_index["built"] = 0
+
+
+async def find_overrides(recipe_ids: list):
+	"""Finds the overrides of the passed recipe identifiers.
+
+	Args:
+		recipe_ids (list): Identifiers of recipe overrides
+
+	Returns:
+		dict:  Paths of the overrides that were found, keyed by their identifier
+	"""
+
+	index = await get_override_index()
+
+	if any(
+		recipe_id in index and not os.path.exists(index[recipe_id]) for recipe_id in recipe_ids
+	):
+		# An override was moved or removed since the index was built
+		invalidate_override_index()
+		index = await get_override_index()
+
+	return { recipe_id: index[recipe_id] for recipe_id in recipe_ids if recipe_id in index }
+
+
+async def file_stat(path: str):
+
+	try:
+		stat = os.stat(path)
+		return [ stat.st_mtime, stat.st_size ]
+	except OSError:
+		return None
+
+
+async def get_trust_info(override: dict):
+	"""Get the parent recipes and non-core processors from an override's trust info.
+
+	Returns:
+		dict:  The sha256 hash of each file, keyed by its path
+	"""
+
+	trust_info = override.get("ParentRecipeTrustInfo") or {}
+
+	return {
+		expand_user(item.get("path")): item.get("sha256_hash")
+		for section in ("parent_recipes", "non_core_processors")
+		for item in (trust_info.get(section) or {}).values()
+		if item.get("path")
+	}
+
+
+async def get_trusted(recipe_ids: list):
+	"""Get the recipes whose trust info passed verification and whose override and parent
+	recipes have not changed since.
+
+	Parent recipes are first compared by their mtime and size and only hashed if those
+	have changed.
+
+	Args:
+		recipe_ids (list): Identifiers of recipe overrides
+
+	Returns:
+		set:  Identifiers of the recipes that do not need to be verified
+	"""
+
+	trusted = set()
+
+	for recipe_trust in await models.RecipeTrust.filter(recipe_id__in=recipe_ids, success=True):
+
+		if await file_stat(recipe_trust.override_path) != recipe_trust.override_stat:
+			continue
+
+		parents = recipe_trust.parents
+		changed = False
+
+		for path, (mtime, size, sha256_hash) in parents.items():
+
+			if (current_stat := await file_stat(path)) == [ mtime, size ]:
+				continue
+
+			if current_stat is None or await asyncio.to_thread(hash_file, path) != sha256_hash:
+				changed = True
+				break
+
+			# Only the metadata changed (e.g. the file was checked out again)
+			parents[path] = [ *current_stat, sha256_hash ]
+
+		if changed:
+			continue
+
+		if parents != recipe_trust.parents:
+			recipe_trust.parents = parents
+			await recipe_trust.save(update_fields=["parents"])
+
+		trusted.add(recipe_trust.recipe_id)
+
+	log.debug(f"Trust info unchanged for {len(trusted)} of {len(recipe_ids)} recipes")
+	return trusted
+
+
+async def record(passed: list | set, failed: list | set):
+	"""Records the results of verifying the trust info of recipes.
+
+	Args:
+		passed (list|set): Identifiers of the recipes whose trust info was verified
+		failed (list|set): Identifiers of the recipes whose trust info failed verification
+	"""
+
+	if failed:
+		await models.RecipeTrust.filter(recipe_id__in=list(failed)).update(success=False)
+
+	if not passed:
+		return
+
+	for recipe_id, override_path in (await find_overrides(passed)).items():
+
+		try:
+			trust_info = await get_trust_info(await load_recipe(override_path))
+		except Exception as error:
+			log.debug(f"Failed to load the override for {recipe_id}:  {error}")
+			continue
+
+		parents = {}
+		missing = []
+
+		for path, sha256_hash in trust_info.items():
+			if current_stat := await file_stat(path):
+				parents[path] = [ *current_stat, sha256_hash ]
+			else:
+				missing.append(path)
+
+		if missing:
+			# Whether these parents change could not be determined, so it is verified every run
+			log.debug(f"Not caching the trust info of {recipe_id}; failed to stat:  {missing}")
+			await models.RecipeTrust.filter(recipe_id=recipe_id).delete()
+			continue
+
+		await models.RecipeTrust.update_or_create(
+			recipe_id = recipe_id,
+			defaults = {
+				"override_path": override_path,
+				"override_stat": await file_stat(override_path),
+				"parents": parents,
+				"success": True
+			}
+		)
+
+
+async def invalidate(recipe_ids: list | None = None):
+
+	if recipe_ids is None:
+		recipe_index["built"] = 0
+		invalidate_override_index()
+		return await models.RecipeTrust.all().delete()
+
+	return await models.RecipeTrust.filter(recipe_id__in=recipe_ids).delete()
+
+
+async def get_search_dirs():
+
+	search_dirs = (await get_autopkg_prefs()).get(
+		"RECIPE_SEARCH_DIRS", [ ".", "~/Library/AutoPkg/Recipes", "/Library/AutoPkg/Recipes" ])
+
+	if isinstance(search_dirs, str):
+		search_dirs = [ search_dirs ]
+
+	return [ os.path.abspath(expand_user(search_dir)) for search_dir in search_dirs ]
+
+
+def get_identifier(path: str):
+
+	try:
+		return read_recipe(path).get("Identifier")
+	except Exception:
+		return None
+
+
+async def get_recipe_index():
+	"""Get the path of every recipe in the recipe search directories, keyed by identifier.
+
+	Like AutoPkg, recipes are searched for in each search directory and its immediate
+	subdirectories and the first recipe found with an identifier is used.  The index is
+	rebuilt after `AutoPkg.recipe_index_ttl` seconds or when the cache is invalidated.
+
+	Returns:
+		dict:  Paths of recipes, keyed by their identifier
+	"""
+
+	if time.monotonic() - recipe_index["built"] < config.AutoPkg.get("recipe_index_ttl", 600):
+		return recipe_index["paths"]
+
+	paths = [
+		path
+		for search_dir in await get_search_dirs()
+		for pattern in ("*", "*/*")
+		for extension in RECIPE_EXTENSIONS
+		for path in sorted(glob.glob(os.path.join(search_dir, f"{pattern}{extension}")))
+	]
+	identifiers = await asyncio.gather(
+		*[ asyncio.to_thread(get_identifier, path) for path in paths ])
+	index = {}
+
+	for path, identifier in zip(paths, identifiers):
+		if identifier and identifier not in index:
+			index[identifier] = path
+
+	recipe_index.update({ "built": time.monotonic(), "paths": index })
+	log.debug(f"Indexed {len(index)} recipes")
+	return index
+
+
+def hash_file(path: str):
+
+	try:
+		with open(path, "rb") as file:
+			return hashlib.sha256(file.read()).hexdigest()
+	except OSError:
+		return None
+
+
+def git_diff(path: str, git_hash: str | None):
+	"""Get the changes to a file since the trusted commit, as `autopkg` reports them."""
+
+	if not git_hash:
+		return ""
+
+	try:
+		repo = git.Repo(os.path.dirname(path), search_parent_directories=True)
+		log_output = repo.git.log(f"{git_hash}..", "--", path)
+		diff_output = repo.git.diff(git_hash, "--", path)
+		return f"{log_output}\n{diff_output}".strip()
+
+	except Exception:
+		return ""
+
+
+def find_processor(name: str, parent_paths: list, index: dict):
+	"""Find the path of a non-core processor, e.g. `com.github.x.shared/Processor` or
+	a processor next to one of the recipes in the parent chain."""
+
+	if "/" in name:
+		recipe_id, processor = name.split("/", 1)
+		directories = [ os.path.dirname(index[recipe_id]) ] if recipe_id in index else []
+	else:
+		processor = name
+		directories = [ os.path.dirname(path) for path in parent_paths ]
+
+	for directory in directories:
+		if os.path.isfile(path := os.path.join(directory, f"{processor}.py")):
+			return path
+
+	return None
+
+
+async def verify_override(override_path: str, index: dict):
+	"""Verifies the trust info of an override against its parent recipes and processors.
+
+	Args:
+		override_path (str): Path to the recipe override
+		index (dict): Paths of recipes, keyed by their identifier
+
+	Returns:
+		list:  Descriptions of each verification failure
+	"""
+
+	override = await load_recipe(override_path)
+
+	if not (trust_info := override.get("ParentRecipeTrustInfo")):
+		return [ "No trust information present." ]
+
+	errors = []
+	parents = {}
+	parent_id = override.get("ParentRecipe")
+
+	while parent_id and parent_id not in parents:
+
+		if not (path := index.get(parent_id)):
+			errors.append(f"Parent recipe {parent_id} was not found.")
+			break
+
+		parents[parent_id] = path
+		parent_id = (await load_recipe(path)).get("ParentRecipe")
+
+	processors = {}
+
+	for path in parents.values():
+		for step in (await load_recipe(path)).get("Process", []):
+			if (
+				(name := step.get("Processor")) not in processors and
+				(processor_path := find_processor(name, list(parents.values()), index))
+			):
+				processors[name] = processor_path
+
+	for item_type, expected, actual in (
+		("Parent recipe", trust_info.get("parent_recipes") or {}, parents),
+		("Processor", trust_info.get("non_core_processors") or {}, processors)
+	):
+
+		names = sorted(set(expected) | set(actual))
+		hashes = await asyncio.gather(
+			*[ asyncio.to_thread(hash_file, actual[name]) if name in actual
+				else asyncio.sleep(0) for name in names ]
+		)
+
+		for name, sha256_hash in zip(names, hashes):
+
+			if name not in actual:
+				errors.append(f"{item_type} {name} is no longer used or was not found.")
+
+			elif name not in expected:
+				errors.append(
+					f"{item_type} {name} is not in the trust info.\n    Path: {actual[name]}")
+
+			elif sha256_hash != expected[name].get("sha256_hash"):
+				message = f"{item_type} {name} contents differ from expected.\n    Path: {actual[name]}"
+
+				if diff := await asyncio.to_thread(
+					git_diff, actual[name], expected[name].get("git_hash")):
+					message = f"{message}\n{diff}"
+
+				errors.append(message)
+
+	return errors
+
+
+async def verify(recipe_ids: list):
+	"""Verifies the trust info of recipe overrides in-process, with the same output as
+	`autopkg verify-trust-info -vvv`.
+
+	Args:
+		recipe_ids (list): Identifiers of recipe overrides
+
+	Returns:
+		dict:  `success`, `stdout` and `stderr`, in the same form as `execute_process`
+	"""
+
+	index = await get_recipe_index()
+	overrides = await find_overrides(recipe_ids)
+	stdout = []
+	stderr = []
+	success = True
+
+	for recipe_id in recipe_ids:
+
+		if not (override_path := overrides.get(recipe_id)):
+			stdout.append(f"Didn't find a recipe for {recipe_id}.")
+			success = False
+			continue
+
+		try:
+			errors = await verify_override(override_path, index)
+		except Exception as error:
+			errors = [ f"Failed to verify trust info:  {error}" ]
+
+		if errors:
+			success = False
+			stderr.append(f"{recipe_id}: FAILED")
+			stderr.extend(
+				"\n".join(f"    {line}" for line in error.splitlines()) for error in errors)
+		else:
+			stdout.append(f"{recipe_id}: OK")
+
+	return {
+		"success": success,
+		"stdout": "\n".join(stdout),
+		"stderr": "\n".join(stderr)
+	}
@@ -43,6 +43,28 @@ class Recipes(Model):
 		table = "recipes"
 
 
+class RecipeTrust(Model):
+	id = fields.IntField(pk=True)
+	recipe_id = fields.CharField(max_length=512, unique=True)
+	override_path = fields.CharField(max_length=1024)
+	override_stat = fields.JSONField()
+	parents = fields.JSONField()
+	success = fields.BooleanField()
+	last_update = fields.DatetimeField(auto_now=True)
+
+	class Meta:
+		table = "recipe_trust"
+
+
+class JamfProStats(Model):
+	process = fields.CharField(max_length=256, pk=True, generated=False)
+	stats = fields.JSONField()
+	last_update = fields.DatetimeField(auto_now=True)
+
+	class Meta:
+		table = "jamf_pro_stats"
+
+
 class Recipe_Filter(BaseModel):
 	enabled: Optional[bool]
 	manual_only: Optional[bool]
@@ -89,11 +111,20 @@ class RecipeResults(Model):
 		table = "recipe_results"
 
 
+async def set_version_fields(pkg_object: "Packages | PackagesManual"):
+	"""Sets the normalized `software_title` and sortable `version_key` of a Package."""
+
+	pkg_object.software_title = (await utility.parse_pkg_name(pkg_object.pkg_name or pkg_object.name))[0]
+	pkg_object.version_key = await utility.version_key(pkg_object.version)
+
+
 class Packages(Model):
 	id = fields.IntField(pk=True)
 	name = fields.CharField(max_length=64)
 	version = fields.CharField(max_length=64)
 	pkg_name = fields.CharField(max_length=256, null=True, unique=True)
+	software_title = fields.CharField(max_length=256, null=True, index=True)
+	version_key = fields.CharField(max_length=256, null=True, index=True)
 	icon = fields.CharField(max_length=1024, null=True)
 	packaged_date = fields.DatetimeField(auto_now_add=True)
 	promoted_date = fields.DatetimeField(null=True, default=None)
@@ -122,6 +153,15 @@ class Packages(Model):
 	class Meta:
 		table = "packages"
 
+	async def save(self, *args, update_fields=None, **kwargs):
+
+		await set_version_fields(self)
+
+		if update_fields:
+			update_fields = { *update_fields, "software_title", "version_key" }
+
+		await super().save(*args, update_fields=update_fields, **kwargs)
+
 
 class PackageNotes(Model):
 	id = fields.IntField(pk=True)
@@ -161,6 +201,8 @@ class PackagesManual(Model):
 	name = fields.CharField(max_length=64)
 	version = fields.CharField(max_length=64)
 	pkg_name = fields.CharField(max_length=256, null=True, unique=True)
+	software_title = fields.CharField(max_length=256, null=True, index=True)
+	version_key = fields.CharField(max_length=256, null=True, index=True)
 	status = fields.CharField(max_length=64, default="dev")
 	policies: fields.ManyToManyRelation["Policies"] = fields.ManyToManyField(
 		model_name = "pkgbot.Policies",
@@ -174,6 +216,29 @@ class PackagesManual(Model):
 	class Meta:
 		table = "packages_manual"
 
+	async def save(self, *args, update_fields=None, **kwargs):
+
+		await set_version_fields(self)
+
+		if update_fields:
+			update_fields = { *update_fields, "software_title", "version_key" }
+
+		await super().save(*args, update_fields=update_fields, **kwargs)
+
+
+class JamfPackages(Model):
+	id = fields.IntField(pk=True, generated=False)
+	name = fields.CharField(max_length=256, index=True)
+	file_name = fields.CharField(max_length=256, null=True)
+	software_title = fields.CharField(max_length=256, index=True)
+	version = fields.CharField(max_length=128, null=True)
+	version_key = fields.CharField(max_length=256, null=True, index=True)
+	size = fields.BigIntField(null=True)
+	last_update = fields.DatetimeField(auto_now=True)
+
+	class Meta:
+		table = "jamf_packages"
+
 
 class Errors(Model):
 	id = fields.IntField(pk=True)
@@ -191,11 +256,23 @@ class Errors(Model):
 		table = "errors"
 
 
+class PreChecks(Model):
+	id = fields.IntField(pk=True)
+	name = fields.CharField(max_length=64, unique=True)
+	status = fields.CharField(max_length=16, null=True)
+	task_id = fields.CharField(max_length=36, null=True)
+	last_update = fields.DatetimeField(null=True)
+
+	class Meta:
+		table = "pre_checks"
+
+
 class Policies(Model):
 	id = fields.IntField(pk=True)
 	policy_id = fields.IntField(unique=True)
 	name = fields.CharField(max_length=256)
 	site = fields.CharField(max_length=128)
+	fingerprint = fields.CharField(max_length=64, null=True)
 
 	class Meta:
 		table = "policies"
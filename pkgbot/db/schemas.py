@@ -20,11 +20,12 @@ RecipeResult_In = pydantic_model_creator(
 Packages_Out = pydantic_model_creator(models.Packages, name="Packages_Out", exclude={ "last_update",
 	"pkg_name", "policiess", "recipe", "recipe_id", "response_url", "slack_channel", "slack_ts" })
 Package_Out = pydantic_model_creator(models.Packages, name="Package_Out")
-Package_In = pydantic_model_creator(models.Packages, name="Package_In", exclude_readonly=True)
+Package_In = pydantic_model_creator(models.Packages, name="Package_In",
+	exclude=("software_title", "version_key"), exclude_readonly=True)
 
 Package_Manual_Out = pydantic_model_creator(models.PackagesManual, name="Package_Manual_Out")
-Package_Manual_In = pydantic_model_creator(
-	models.PackagesManual, name="Package_Manual_In", exclude_readonly=True)
+Package_Manual_In = pydantic_model_creator(models.PackagesManual, name="Package_Manual_In",
+	exclude=("software_title", "version_key"), exclude_readonly=True)
 
 PackageNote_Out = pydantic_model_creator(models.PackageNotes, name="PackageNote_Out")
 PackageNote_In = pydantic_model_creator(
@@ -34,6 +35,8 @@ PackageHold_Out = pydantic_model_creator(models.PackageHold, name="PackageHold_O
 PackageHold_In = pydantic_model_creator(
 	models.PackageHold, name="PackageHold_In", exclude_readonly=True)
 
+JamfPackage_Out = pydantic_model_creator(models.JamfPackages, name="JamfPackage_Out")
+
 Error_Out = pydantic_model_creator(models.Errors, name="Error_Out")
 Error_In = pydantic_model_creator(models.Errors, name="Error_In", exclude_readonly=True)
 
@@ -37,6 +37,10 @@ tags_metadata = [
 		"name": "autopkg",
 		"description": "Handles all **AutoPkg** processes.",
 	},
+	{
+		"name": "jamf_pro",
+		"description": "Receives **Jamf Pro** webhooks.",
+	},
 	{
 		"name": "package",
 		"description": "Manage **Package** objects.",
@@ -1,28 +1,24 @@
 import asyncio
-import collections
 import hashlib
-import json
-import math
 import os
-import re
-import threading
 
 from datetime import datetime, timedelta, timezone
+from tempfile import TemporaryDirectory
 
 import git
 import requests
 
-from celery import chain, group, shared_task
+from celery import chord, shared_task
+from kombu.utils import json as kombu_json
 
 from pkgbot import config, core
-from pkgbot.db import models, schemas
+from pkgbot.db import models
 from pkgbot.tasks import task_utils
 from pkgbot.utilities import common as utility
 
 
 config = config.load_config()
 log = utility.log
-thread_local = threading.local()
 
 
 ##################################################
@@ -34,93 +30,124 @@ def determine_priority(default: int, ingress: str):
 	return default + 1 if ingress == "Slack" else default
 
 
-@shared_task(name="pkgbot:send_webhook", bind=True)
-def send_webhook(self, task_id):
-	""" Sends webhook after a task is complete. """
+@shared_task(base=task_utils.PkgBotTask, name="pkgbot:send_webhook", bind=True)
+def send_webhook(self, task_id, task_results: dict | None = None):
+	"""Sends webhook after a task is complete.
+
+	If the task results are passed (and are not larger than `webhook_max_size`), they are
+	sent with the webhook, so that they do not need to be retrieved from the result backend.
+	"""
 
 	pkgbot_server, headers = task_utils.api_url_helper()
-	data = { "task_id": task_id }
+	# Encoded the same as results stored in the result backend
+	data = kombu_json.dumps({ "task_id": task_id, "task_results": task_results })
+
+	if task_results is not None and len(data.encode("UTF-8")) > config.PkgBot.get("webhook_max_size", 1_000_000):
+		log.debug(f"Task results are too large to send with the webhook for task:  {task_id}")
+		data = kombu_json.dumps({ "task_id": task_id })
 
-	headers["x-pkgbot-signature"] = asyncio.run(utility.compute_hex_digest(
+	headers["x-pkgbot-signature"] = task_utils.run_async(utility.compute_hex_digest(
 		config.PkgBot.get("webhook_secret").encode("UTF-8"),
-		str(data).encode("UTF-8"),
+		data.encode("UTF-8"),
 		hashlib.sha512
 	))
 
-	requests.post(f"{pkgbot_server}/autopkg/receive",
+	requests.post(f"{pkgbot_server}/tasks/receive",
 		headers=headers,
-		data=json.dumps(data),
+		data=data,
 	)
 
 
-def get_or_create_event_loop():
-	if not hasattr(thread_local, "loop") or thread_local.loop.is_closed():
-		thread_local.loop = asyncio.new_event_loop()
-		asyncio.set_event_loop(thread_local.loop)
-	return thread_local.loop
+def notify(task_id: str, task_results: dict, queue: str = "autopkg"):
+	"""Queues the webhook that notifies PkgBot that a task is complete; with
+	`webhook_results`, the task results are sent with it.
+
+	Args:
+		task_id (str): Task ID of the completed task
+		task_results (dict): Results of the completed task
+		queue (str): Queue to send the webhook from
+
+	Returns:
+		dict:  The passed task results
+	"""
+
+	send_webhook.apply_async(
+		(task_id, task_results if config.PkgBot.get("webhook_results") else None),
+		queue=queue,
+		priority=9
+	)
+
+	return task_results
 
 
 ##################################################
 # Scheduled Tasks
 
 
-@shared_task
+@shared_task(base=task_utils.PkgBotTask)
 def test(arg):
 	log.debug(arg)
 
 
+@shared_task(base=task_utils.PkgBotTask, name="autopkg:prune_output_logs")
+def prune_output_logs():
+	"""Removes the `autopkg run` output logs that are older than the retention period"""
+
+	removed = task_utils.prune_output_logs()
+	log.info(f"Removed {removed} expired `autopkg run` output logs")
+
+	return { "removed": removed }
+
+
 ##################################################
 # Pre-check Tasks
 
 
 def perform_pre_checks(task_id: str, ignore_parent_trust: bool):
-	"""Perform pre-checks before running `autopkg run`
+	"""Determine the pre-checks to perform before running `autopkg run`
+
+	Pre-checks that passed within the freshness window are reused and those that another
+	task is already refreshing are left for the callback to wait on.
 
 	Args:
 		task_id (str): Calling tasks' task_id
 		ignore_parent_trust (bool): Whether --ignore-parent-trust-verification-info was passed
 
 	Returns:
-		dict|list:
-			if dict: contains error information from failed pre-checks
-			if list: contains child `task_id`s
+		tuple(list, list, list):  Signatures of the pre-check tasks to perform, the names
+			of those pre-checks and the names of the pre-checks that are pending
 	"""
 
-	# Track all child tasks that are queued
-	queued_tasks = []
-	failed_pre_checks = []
-
-	pre_checks = [check_space.signature(), git_pull_private_repo.signature()]
+	pre_checks = {
+		"check_space": check_space.signature(),
+		"git_pull_private_repo": git_pull_private_repo.signature()
+	}
 
 	if not ignore_parent_trust:
-		pre_checks.extend([autopkg_repo_update.signature()])
+		pre_checks["autopkg_repo_update"] = autopkg_repo_update.signature()
 
-	tasks_results = (
-		group(pre_checks).apply_async(queue="autopkg", priority=8)).get(disable_sync_subtasks=False)
+	signatures = []
+	refreshed_checks = []
+	pending_checks = []
 
-	# Check results
-	for task_result in tasks_results:
+	for name, signature in pre_checks.items():
 
-		if not task_result["success"]:
-			send_webhook.apply_async((task_id,), queue='autopkg', priority=9)
-			failed_pre_checks.append(task_result["task_id"])
+		match task_utils.run_async(core.pre_check.claim(name, task_id)):
 
-		queued_tasks.append(task_result["task_id"])
+			case "claimed":
+				signatures.append(signature.set(queue="autopkg", priority=8))
+				refreshed_checks.append(name)
 
-	if failed_pre_checks:
-		return {
-			"event": "failed_pre_checks",
-			"stdout": "Error",
-			"stderr": "Error",
-			"status": 1,
-			"success": False,
-			"task_id": failed_pre_checks
-		}
+			case "pending":
+				pending_checks.append(name)
 
-	return queued_tasks
+			case "fresh":
+				log.debug(f"Reusing pre-check result:  {name}")
 
+	return signatures, refreshed_checks, pending_checks
 
-@shared_task(name="pkgbot:check_space", bind=True)
+
+@shared_task(base=task_utils.PkgBotTask, name="pkgbot:check_space", bind=True)
 def check_space(self):
 	"""Checks free space on PkgBot storage volume"""
 
@@ -128,7 +155,7 @@ def check_space(self):
 	warning_free_space = config.AutoPkg.get("warning_free_space")
 	cache_volume = config.AutoPkg.get("cache_volume")
 	log.debug(f"Checking available free space on:  {cache_volume}")
-	current_free_space = asyncio.run(utility.get_disk_usage(cache_volume))[2]
+	current_free_space = task_utils.run_async(utility.get_disk_usage(cache_volume))[2]
 	current_free_space_int, current_free_space_unit = current_free_space.split(" ")
 	log.debug(f"Free space:  {current_free_space}")
 	success = True
@@ -148,13 +175,12 @@ def check_space(self):
 		msg = f"AutoPkg cache volume is running low on disk space:  {current_free_space}"
 		status = 1
 		log.warning(msg)
-		send_webhook.apply_async((self.request.id,), queue="autopkg", priority=9)
 
 	else:
 		event = "disk_space_passed"
 		msg = "Disk Check:  Passed"
 
-	return {
+	results = {
 		"event": event,
 		"stdout": msg,
 		"stderr": msg,
@@ -163,8 +189,13 @@ def check_space(self):
 		"task_id": self.request.id
 	}
 
+	if event == "disk_space_warning":
+		notify(self.request.id, results)
 
-@shared_task(name="git:pull_private_repo", bind=True)
+	return results
+
+
+@shared_task(base=task_utils.PkgBotTask, name="git:pull_private_repo", bind=True)
 def git_pull_private_repo(self):
 	"""Perform a `git pull` for the local private repo"""
 
@@ -200,7 +231,7 @@ def git_pull_private_repo(self):
 					# private_repo.delete_head(repo_push_branch)
 					# For safety, just renaming the branch for now and after a bit of real world
 					# testing, switch to deleting the branch
-					timestamp = asyncio.run(utility.get_timestamp("%Y-%m-%d_%I-%M-%S"))
+					timestamp = task_utils.run_async(utility.get_timestamp("%Y-%m-%d_%I-%M-%S"))
 					private_repo.branches[repo_push_branch].rename(
 						f"{repo_push_branch}_{timestamp}")
 
@@ -215,6 +246,8 @@ def git_pull_private_repo(self):
 			raise
 
 		_ = private_repo.remotes.origin.pull()
+		# Overrides may have been added, moved or removed
+		core.trust.invalidate_override_index()
 
 		results_git_pull_command = {
 			"stdout": "Success",
@@ -259,7 +292,7 @@ def git_pull_private_repo(self):
 #  AutoPkg Tasks
 
 
-@shared_task(name="autopkg:verb_parser", bind=True)
+@shared_task(base=task_utils.PkgBotTask, name="autopkg:verb_parser", bind=True)
 def autopkg_verb_parser(self, **kwargs):
 	"""Handles `autopkg` tasks.
 
@@ -276,9 +309,6 @@ def autopkg_verb_parser(self, **kwargs):
 
 	# log.debug(f"Calling kwargs:  {kwargs}")
 
-	# Track all child tasks that are queued by this parent task
-	queued_tasks = []
-
 	autopkg_cmd = kwargs.get("autopkg_cmd")
 	recipes = kwargs.get("recipes")
 	repos = kwargs.get("repos")
@@ -295,56 +325,192 @@ def autopkg_verb_parser(self, **kwargs):
 
 		case _:
 
-			if not autopkg_cmd.get("promote"):
+			if autopkg_cmd.get("promote"):
+				return { "Queued background tasks":
+					dispatch_verb(self.request.id, recipes, autopkg_cmd, event_id) }
+
+			pre_checks, refreshed_checks, pending_checks = perform_pre_checks(
+				self.request.id, autopkg_cmd.get("ignore_parent_trust"))
+
+			callback = autopkg_dispatch.signature(
+				kwargs = {
+					"recipes": recipes,
+					"autopkg_cmd": autopkg_cmd,
+					"event_id": event_id,
+					"parent_task_id": self.request.id,
+					"refreshed_checks": refreshed_checks,
+					"pending_checks": pending_checks
+				},
+				queue="autopkg", priority=8
+			)
+			callback.link_error(autopkg_dispatch_failed.signature(
+				kwargs = { "parent_task_id": self.request.id, "refreshed_checks": refreshed_checks }))
+
+			if not pre_checks:
+				return { "Queued background tasks": [ callback.apply_async(([],)).id ] }
+
+			# Queue the pre-checks with the verb dispatch as their callback instead of
+			# waiting on their results here, which would occupy this worker until they finish
+			chord_results = chord(pre_checks)(callback)
 
-				results_pre_check = perform_pre_checks(
-					self.request.id, autopkg_cmd.get("ignore_parent_trust"))
+			return { "Queued background tasks":
+				[ *( result.id for result in chord_results.parent.results ), chord_results.id ] }
+
+
+@shared_task(base=task_utils.PkgBotTask, name="autopkg:dispatch", bind=True)
+def autopkg_dispatch(self, pre_check_results: list, recipes: list | str | None,
+	autopkg_cmd: dict, event_id: int | None = None, parent_task_id: str | None = None,
+	refreshed_checks: list | None = None, pending_checks: list | None = None):
+	"""Callback of the pre-checks queued by `autopkg:verb_parser`; queues the
+	requested `autopkg` verb if all pre-checks were successful.
+
+	If pre-checks are being refreshed by another task, this task is retried until
+	they have completed.
+
+	Args:
+		pre_check_results (list): Results of the pre-check tasks
+		recipes (list|str|None): Recipe(s) (in dicts, in which contains their configurations)
+		autopkg_cmd (dict): Contains options for `autopkg` and details on response method
+		event_id (int|None): ID of an event from the PkgBot database
+		parent_task_id (str|None): task_id of the calling `autopkg:verb_parser` task
+		refreshed_checks (list|None): Names of the pre-checks in `pre_check_results`
+		pending_checks (list|None): Names of the pre-checks being refreshed by another task
+
+	Returns:
+		dict:  dict describing the results of the ran process
+	"""
+
+	if not self.request.retries:
+		for name, task_result in zip(refreshed_checks or [], pre_check_results):
+			task_utils.run_async(
+				core.pre_check.record(name, task_result["success"], task_result["task_id"]))
+
+	if failed_pre_checks := [
+		task_result["task_id"] for task_result in pre_check_results if not task_result["success"]
+	]:
+		return notify(self.request.id, {
+			"event": "failed_pre_checks",
+			"stdout": "Error",
+			"stderr": "Error",
+			"status": 1,
+			"success": False,
+			"task_id": failed_pre_checks
+		})
+
+	if pending_checks:
+
+		pre_checks = task_utils.run_async(core.pre_check.get(pending_checks))
+
+		if any(
+			pre_check.status == "running" and not task_utils.run_async(core.pre_check.is_stale(pre_check))
+			for pre_check in pre_checks.values()
+		):
+			raise self.retry(countdown=5, max_retries=None)
+
+		if failed_pre_checks := [
+			pre_check.task_id for pre_check in pre_checks.values() if pre_check.status != "success"
+		]:
+			log.error(f"Pre-checks performed by another task failed:  {failed_pre_checks}")
+
+			return notify(self.request.id, {
+				"event": "failed_pre_checks",
+				"stdout": "Error",
+				"stderr": "Error",
+				"status": 1,
+				"success": False,
+				"task_id": failed_pre_checks
+			})
+
+	return { "Queued background tasks":
+		dispatch_verb(parent_task_id or self.request.id, recipes, autopkg_cmd, event_id) }
+
+
+@shared_task(base=task_utils.PkgBotTask, name="autopkg:dispatch_failed")
+def autopkg_dispatch_failed(request, exc, traceback, parent_task_id: str | None = None,
+	refreshed_checks: list | None = None):
+	"""Error callback of `autopkg:dispatch`, called when a pre-check (and so the chord) or
+	the dispatch itself raised.
+
+	The pre-checks claimed by the calling task whose results were not recorded are failed,
+	so they are not left `running`, and PkgBot is notified of the failure.
+
+	Args:
+		request (celery.app.task.Context): Request of the failed `autopkg:dispatch` task
+		exc (Exception): The exception that was raised
+		traceback (traceback|None): Traceback of the exception, if available
+		parent_task_id (str|None): task_id of the calling `autopkg:verb_parser` task
+		refreshed_checks (list|None): Names of the pre-checks claimed by the calling task
+
+	Returns:
+		dict:  dict describing the results of the failure
+	"""
+
+	log.error(f"Pre-checks or dispatch of task {parent_task_id} failed:  {exc!r}")
+	task_utils.run_async(
+		core.pre_check.release(refreshed_checks or [], parent_task_id, request.id))
+
+	return notify(request.id, {
+		"event": "failed_pre_checks",
+		"stdout": "Error",
+		"stderr": f"{type(exc).__name__}:  {exc}",
+		"status": 1,
+		"success": False,
+		"task_id": [ request.id ]
+	})
+
+
+def dispatch_verb(task_id: str, recipes: list | str | None, autopkg_cmd: dict,
+	event_id: int | None = None):
+	"""Queues the tasks for the `autopkg` verb in `autopkg_cmd`.
+
+	Args:
+		task_id (str): Calling tasks' task_id
+		recipes (list|str|None): Recipe(s) (in dicts, in which contains their configurations)
+		autopkg_cmd (dict): Contains options for `autopkg` and details on response method
+		event_id (int|None): ID of an event from the PkgBot database
 
-				if isinstance(results_pre_check, dict):
-					# An error occurred in a pre-check
-					return results_pre_check
+	Returns:
+		list: task_ids of the queued tasks
+	"""
 
-				queued_tasks.extend(results_pre_check)
+	# Track all child tasks that are queued
+	queued_tasks = []
 
-			match verb:
+	match autopkg_cmd.get("verb"):
 
-				case "verify-trust-info":
+		case "verify-trust-info":
 
-					queued_task = autopkg_verify_trust.apply_async(
-						(recipes, autopkg_cmd, self.request.id),
-						queue="autopkg", priority=4
-					)
-					queued_tasks.append(queued_task.id)
+			queued_task = autopkg_verify_trust.apply_async(
+				(recipes, autopkg_cmd, task_id),
+				queue="autopkg", priority=4
+			)
+			queued_tasks.append(queued_task.id)
 
-				case "update-trust-info":
+		case "update-trust-info":
 
-					queued_task = autopkg_update_trust.apply_async(
-						(recipes, autopkg_cmd, event_id, self.request.id),
-						queue="autopkg", priority=4
-					)
-					queued_tasks.append(queued_task.id)
+			queued_task = autopkg_update_trust.apply_async(
+				(recipes, autopkg_cmd, event_id, task_id),
+				queue="autopkg", priority=4
+			)
+			queued_tasks.append(queued_task.id)
 
-				case "run":
+		case "run":
 
-					results = autopkg_run(recipes, autopkg_cmd, event_id=event_id)
-					queued_tasks.extend(results)
+			results = autopkg_run(recipes, autopkg_cmd, event_id=event_id)
+			queued_tasks.extend(results)
 
-			return { "Queued background tasks": queued_tasks }
+	return queued_tasks
 
 
-@shared_task(name="autopkg:repo_update", bind=True)
+@shared_task(base=task_utils.PkgBotTask, name="autopkg:repo_update", bind=True)
 def autopkg_repo_update(self):
 	"""Performs an `autopkg repo-update all`"""
 
 	log.info("Updating parent recipe repos...")
-	autopkg_repo_update_command = ( f"{config.AutoPkg.get('binary')} repo-update all "
-		f"--prefs=\'{os.path.abspath(config.JamfPro_Dev.get('autopkg_prefs'))}\'" )
-
-	if task_utils.get_user_context():
-		autopkg_repo_update_command = ( f"su - {task_utils.get_console_user()} -c"
-			f"\"{autopkg_repo_update_command}\"" )
+	autopkg_repo_update_command = [ config.AutoPkg.get("binary"), "repo-update", "all",
+		f"--prefs={os.path.abspath(config.JamfPro_Dev.get('autopkg_prefs'))}" ]
 
-	results_autopkg_repo_update = asyncio.run(utility.execute_process(autopkg_repo_update_command))
+	results_autopkg_repo_update = task_utils.execute_autopkg(autopkg_repo_update_command)
 
 ##### This if statement can be removed after further real world testing...
 	if not results_autopkg_repo_update["success"]:
@@ -360,7 +526,7 @@ def autopkg_repo_update(self):
 	return results_autopkg_repo_update
 
 
-@shared_task(name="autopkg:run", bind=True)
+@shared_task(base=task_utils.PkgBotTask, name="autopkg:run", bind=True)
 def autopkg_run(self, recipes: list, autopkg_cmd: dict, **kwargs):
 	"""Creates parent and individual recipe tasks.
 
@@ -378,6 +544,8 @@ def autopkg_run(self, recipes: list, autopkg_cmd: dict, **kwargs):
 	# Track all child tasks that are queued by this parent task
 	queued_tasks = []
 	promote = autopkg_cmd.pop("promote", False)
+	batch_recipe_ids = []
+	verify_recipe_ids = []
 
 	for recipe in recipes:
 
@@ -396,8 +564,12 @@ def autopkg_run(self, recipes: list, autopkg_cmd: dict, **kwargs):
 			_ = autopkg_cmd.pop("match_pkg", None)
 			_ = autopkg_cmd.pop("pkg_only", None)
 
+			if config.AutoPkg.get("batch_mode"):
+				# `autopkg run` verifies trust info itself, so it's not verified separately
+				batch_recipe_ids.append(recipe_id)
+
 			# If ignore parent trust, don't run autopkg_verify_trust
-			if autopkg_cmd.get("ignore_parent_trust"):
+			elif autopkg_cmd.get("ignore_parent_trust"):
 
 				queued_task = run_recipe.apply_async(
 					({"success": True}, recipe_id, autopkg_cmd),
@@ -408,24 +580,8 @@ def autopkg_run(self, recipes: list, autopkg_cmd: dict, **kwargs):
 				queued_tasks.append(queued_task.id)
 
 			else:
-
-				# Perform `verify-trust-info` and pass the results to next task.
-				# `verify-trust-info` task has a lower priority _here_ so that `recipe_run`
-				# tasks can run after; instead of all `verify-trust-info` tasks running first.
-				chain_results = chain(
-					autopkg_verify_trust.signature(
-						(recipe_id, autopkg_cmd),
-						queue="autopkg",
-						priority=determine_priority(2, autopkg_cmd.get("ingress"))
-					) |
-					run_recipe.signature(
-						(recipe_id, autopkg_cmd),
-						queue="autopkg",
-						priority=determine_priority(3, autopkg_cmd.get("ingress"))
-					)
-				)()
-
-				queued_tasks.extend([chain_results.parent, chain_results.task_id])
+				# Trust info is verified in batches, which then queue the recipe runs
+				verify_recipe_ids.append(recipe_id)
 
 		else:
 			log.info(f"Promoting to production: {autopkg_cmd['match_pkg']}")
@@ -453,10 +609,172 @@ def autopkg_run(self, recipes: list, autopkg_cmd: dict, **kwargs):
 
 			queued_tasks.append(queued_task.id)
 
+	if verify_recipe_ids:
+
+		# Skip verifying recipes whose trust info passed and hasn't changed since
+		trusted = task_utils.run_async(core.trust.get_trusted(verify_recipe_ids))
+		verify_recipe_ids = [
+			recipe_id for recipe_id in verify_recipe_ids if recipe_id not in trusted ]
+
+		for recipe_id in trusted:
+
+			queued_task = run_recipe.apply_async(
+				({"success": True}, recipe_id, autopkg_cmd),
+				queue="autopkg",
+				priority=determine_priority(3, autopkg_cmd.get("ingress"))
+			)
+
+			queued_tasks.append(queued_task.id)
+
+	if config.AutoPkg.get("verify_and_run"):
+
+		for recipe_id in verify_recipe_ids:
+
+			queued_task = verify_and_run.apply_async(
+				(recipe_id, autopkg_cmd),
+				queue="autopkg",
+				priority=determine_priority(3, autopkg_cmd.get("ingress"))
+			)
+
+			queued_tasks.append(queued_task.id)
+
+		verify_recipe_ids = []
+
+	verify_batch_size = config.AutoPkg.get("verify_trust_batch_size", 50)
+
+	for index in range(0, len(verify_recipe_ids), verify_batch_size):
+
+		# `verify-trust-info` task has a lower priority _here_ so that `recipe_run`
+		# tasks can run after; instead of all `verify-trust-info` tasks running first.
+		queued_task = autopkg_verify_trust_batch.apply_async(
+			(verify_recipe_ids[index:index + verify_batch_size], autopkg_cmd),
+			queue="autopkg",
+			priority=determine_priority(2, autopkg_cmd.get("ingress"))
+		)
+
+		queued_tasks.append(queued_task.id)
+
+	batch_size = config.AutoPkg.get("batch_size", 25)
+
+	for index in range(0, len(batch_recipe_ids), batch_size):
+
+		queued_task = run_recipe_batch.apply_async(
+			(batch_recipe_ids[index:index + batch_size], autopkg_cmd),
+			queue="autopkg",
+			priority=determine_priority(3, autopkg_cmd.get("ingress"))
+		)
+
+		queued_tasks.append(queued_task.id)
+
 	return queued_tasks
 
 
-@shared_task(name="autopkg:run_recipe", bind=True)
+@shared_task(base=task_utils.PkgBotTask, name="autopkg:run_recipe_batch", bind=True)
+def run_recipe_batch(self, recipe_ids: list, autopkg_cmd: dict):
+	"""Runs the passed recipe ids in a single `autopkg run` using a recipe list.
+
+	Args:
+		recipe_ids (list): Recipe IDs of the recipes to run
+		autopkg_cmd (dict): Contains options for `autopkg` and details on response method
+
+	Recipes that failed are verified to determine if they failed due to their trust info,
+	which are reported in the same form as `autopkg:verify-trust-batch`.
+
+	Returns:
+		dict:  dict describing the results of the ran process, with the results of each
+			recipe in the same form as `autopkg:run_recipe` in `recipe_results`
+	"""
+
+	log.info(f"Creating `autopkg run` task for {len(recipe_ids)} recipes:  {recipe_ids}")
+
+	with TemporaryDirectory() as temp_dir:
+
+		recipe_list = os.path.join(temp_dir, "recipe_list.txt")
+		report_plist = os.path.join(temp_dir, "report.plist")
+
+		with open(recipe_list, "w") as recipe_list_file:
+			recipe_list_file.write("\n".join(recipe_ids))
+
+		# The user AutoPkg runs as needs to be able to read the recipe list and write the report
+		if run_as := task_utils.get_run_as():
+			os.chown(temp_dir, run_as["user"], run_as["group"])
+			os.chown(recipe_list, run_as["user"], run_as["group"])
+
+		# Generate AutoPkg options
+		options = task_utils.generate_autopkg_args(**autopkg_cmd)
+		# Build the autopkg command
+		cmd = [ config.AutoPkg.get("binary"), "run", f"--recipe-list={recipe_list}",
+			f"--report-plist={report_plist}", *options ]
+
+		with task_utils.autopkg_run_slot(recipe_ids) as acquired:
+
+			if not acquired:
+				log.debug("A recipe in the batch is already running or no run slots are available")
+				raise self.retry(
+					countdown=config.AutoPkg.get("lock_retry_interval", 15), max_retries=None)
+
+			# log.debug(f"Command to execute:  {cmd}")
+			results = task_utils.run_autopkg(self, cmd)
+
+		try:
+			report = task_utils.run_async(utility.plist_reader(report_plist))
+		except Exception:
+			log.error(f"Failed to read the report plist for task:  {self.request.id}")
+			report = {}
+
+	recipe_output = task_utils.run_async(utility.split_recipe_list_output(results["stdout"]))
+	failures = { failure.get("recipe"): failure for failure in report.get("failures", []) }
+	trust_failures = {}
+
+	if not autopkg_cmd.get("ignore_parent_trust") and (failed_recipe_ids := [
+		recipe_id for recipe_id in recipe_ids
+		if recipe_id in failures or not recipe_output.get(recipe_id)
+	]):
+		# `autopkg run` verifies trust info itself; determine which failures were due to it
+		_, _, trust_failures = verify_trust_info(failed_recipe_ids, autopkg_cmd)
+
+	completed = task_utils.run_async(utility.get_timestamp())
+	recipe_results = []
+
+	for recipe_id in recipe_ids:
+
+		stdout = recipe_output.get(recipe_id, "")
+		event = "recipe_run_dev"
+
+		if recipe_id in trust_failures:
+			log.error(f"Failed to verify trust info for recipe: {recipe_id}")
+			event = "verify_trust_info"
+			stderr = trust_failures[recipe_id]
+		elif failure := failures.get(recipe_id):
+			stderr = f"{failure.get('message')}\n{failure.get('traceback', '')}".rstrip()
+		elif not stdout:
+			# The recipe wasn't processed
+			stderr = results["stderr"]
+		else:
+			stderr = ""
+
+		recipe_results.append({
+			"autopkg_cmd": autopkg_cmd | {"completed": completed},
+			"event": event,
+			"event_id": None,
+			"recipe_id": recipe_id,
+			"success": bool(stdout) and event == "recipe_run_dev" and recipe_id not in failures,
+			"stdout": stdout,
+			"stderr": stderr,
+			"task_id": self.request.id
+		})
+
+	# Send task complete notification
+	return notify(self.request.id, {
+		"event": "recipe_run_batch",
+		"recipe_results": recipe_results,
+		"success": results["success"],
+		"log_file": results.get("log_file"),
+		"task_id": self.request.id
+	})
+
+
+@shared_task(base=task_utils.PkgBotTask, name="autopkg:run_recipe", bind=True)
 def run_recipe(self, parent_task_results: dict, recipe_id: str, autopkg_cmd: dict):
 	"""Runs the passed recipe id against `autopkg run`.
 
@@ -469,6 +787,23 @@ def run_recipe(self, parent_task_results: dict, recipe_id: str, autopkg_cmd: dic
 		dict:  dict describing the results of the ran process
 	"""
 
+	return recipe_run(self, parent_task_results, recipe_id, autopkg_cmd)
+
+
+def recipe_run(task, parent_task_results: dict, recipe_id: str, autopkg_cmd: dict):
+	"""Runs the passed recipe id against `autopkg run` for the calling task, unless
+	the results of verifying its trust info were not successful.
+
+	Args:
+		task (celery.Task): The calling (bound) task
+		parent_task_results (dict): Results from the calling task
+		recipe_id (str): Recipe ID of a recipe
+		autopkg_cmd (dict): Contains options for `autopkg` and details on response method
+
+	Returns:
+		dict:  dict describing the results of the ran process
+	"""
+
 	run_type = "recipe_run_prod" if \
 		parent_task_results.get("event") == "promote" else "recipe_run_dev"
 
@@ -493,18 +828,17 @@ def run_recipe(self, parent_task_results: dict, recipe_id: str, autopkg_cmd: dic
 			event_type = "error"
 
 		log.error(f"{log_msg} recipe: {recipe_id}")
-		send_webhook.apply_async((self.request.id,), queue="autopkg", priority=9)
 
-		return {
+		return notify(task.request.id, {
 			"event": event_type,
 			# "event_id": event_id,
-			"autopkg_cmd": autopkg_cmd | {"completed": asyncio.run(utility.get_timestamp())},
+			"autopkg_cmd": autopkg_cmd | {"completed": task_utils.run_async(utility.get_timestamp())},
 			"recipe_id": recipe_id,
 			"success": parent_task_results["success"],
 			"stdout": parent_task_results["stdout"],
 			"stderr": parent_task_results["stderr"],
-			"task_id": self.request.id
-		}
+			"task_id": task.request.id
+		})
 
 	else:
 		log.info(f"Creating `autopkg run` task for recipe:  {recipe_id}")
@@ -512,30 +846,37 @@ def run_recipe(self, parent_task_results: dict, recipe_id: str, autopkg_cmd: dic
 		# Generate AutoPkg options
 		options = task_utils.generate_autopkg_args(**autopkg_cmd)
 		# Build the autopkg command
-		cmd = f"{config.AutoPkg.get('binary')} run {recipe_id} {options}"
+		cmd = [ config.AutoPkg.get("binary"), "run", recipe_id, *options ]
 
-		if task_utils.get_user_context():
-			cmd = f"su - {task_utils.get_console_user()} -c \"{cmd}\""
+		# Promotions run a template recipe, so lock the recipe being promoted instead
+		with task_utils.autopkg_run_slot(
+			autopkg_cmd.get("promote_recipe_id", recipe_id),
+			"upload" if run_type == "recipe_run_prod" else "run"
+		) as acquired:
 
-		# log.debug(f"Command to execute:  {cmd}")
-		results = asyncio.run(utility.execute_process(cmd))
+			if not acquired:
+				log.debug(f"Recipe is already running or no run slots are available:  {recipe_id}")
+				raise task.retry(
+					countdown=config.AutoPkg.get("lock_retry_interval", 15), max_retries=None)
 
-		# Send task complete notification
-		send_webhook.apply_async((self.request.id,), queue="autopkg", priority=9)
+			# log.debug(f"Command to execute:  {cmd}")
+			results = task_utils.run_autopkg(task, cmd, recipe_id)
 
-		return {
-			"autopkg_cmd": autopkg_cmd | {"completed": asyncio.run(utility.get_timestamp())},
+		# Send task complete notification
+		return notify(task.request.id, {
+			"autopkg_cmd": autopkg_cmd | {"completed": task_utils.run_async(utility.get_timestamp())},
 			"event": run_type,
 			"event_id": parent_task_results.get("id"),
 			"recipe_id": recipe_id,
 			"success": results["success"],
 			"stdout": results["stdout"],
 			"stderr": results["stderr"],
-			"task_id": self.request.id
-		}
+			"log_file": results.get("log_file"),
+			"task_id": task.request.id
+		})
 
 
-@shared_task(name="autopkg:verify-trust", bind=True)
+@shared_task(base=task_utils.PkgBotTask, name="autopkg:verify-trust", bind=True)
 def autopkg_verify_trust(self, recipe_id: str, autopkg_cmd: dict, task_id: str | None = None):
 	"""Runs the passed recipe id against `autopkg verify-trust-info`.
 
@@ -562,32 +903,160 @@ def autopkg_verify_trust(self, recipe_id: str, autopkg_cmd: dict, task_id: str |
 	# Generate AutoPkg options
 	options = task_utils.generate_autopkg_args(**autopkg_cmd)
 	# Build the autopkg command
-	cmd = f"{config.AutoPkg.get('binary')} verify-trust-info {recipe_id} {options}"
-
-	if task_utils.get_user_context():
-		cmd = f"su - {task_utils.get_console_user()} -c \"{cmd}\""
+	cmd = [ config.AutoPkg.get("binary"), "verify-trust-info", recipe_id, *options ]
 
 	# log.debug(f"Command to execute:  {cmd}")
-	results = asyncio.run(utility.execute_process(cmd))
+	results = task_utils.execute_autopkg(cmd)
+	task_utils.run_async(core.trust.record(
+		*(([ recipe_id ], []) if results["success"] else ([], [ recipe_id ]))))
 
 	if autopkg_cmd.get("ingress") in { "api", "Slack" } and \
 		autopkg_cmd.get("verb") == "verify-trust-info":
-		send_webhook.apply_async((self.request.id,), queue="autopkg", priority=9)
 
-		return {
+		return notify(self.request.id, {
 			"event": "verify_trust_info",
-			"autopkg_cmd": autopkg_cmd | {"completed": asyncio.run(utility.get_timestamp())},
+			"autopkg_cmd": autopkg_cmd | {"completed": task_utils.run_async(utility.get_timestamp())},
 			"recipe_id": recipe_id,
 			"success": results["success"],
 			"stdout": results["stdout"],
 			"stderr": results["stderr"],
 			"task_id": self.request.id
-		}
+		})
 
 	return results
 
 
-@shared_task(name="autopkg:update-trust", bind=True)
+def verify_trust_info(recipe_ids: list, autopkg_cmd: dict):
+	"""Verifies the trust info of the passed recipe ids, with a single
+	`autopkg verify-trust-info` or in-process, and records the results.
+
+	Args:
+		recipe_ids (list): Recipe IDs of the recipes to verify
+		autopkg_cmd (dict): Contains options for `autopkg` and details on response method
+
+	Returns:
+		tuple(dict, set, dict):  The results of the process, the recipes that passed and the
+			recipes that failed, with the output of their failure
+	"""
+
+	# Not overriding verbose when verifying trust info
+	verify_cmd = {
+		key: value for key, value in autopkg_cmd.items()
+		if key not in { "quiet", "verbose", "overrides" }
+	} | {
+		"prefs": os.path.abspath(config.JamfPro_Dev.get("autopkg_prefs")),
+		"verbose": "vvv"
+	}
+
+	if config.AutoPkg.get("native_trust_verification"):
+		results = task_utils.run_async(core.trust.verify(recipe_ids))
+
+	else:
+		# Generate AutoPkg options
+		options = task_utils.generate_autopkg_args(**verify_cmd)
+		# Build the autopkg command
+		cmd = [ config.AutoPkg.get("binary"), "verify-trust-info", *recipe_ids, *options ]
+
+		# log.debug(f"Command to execute:  {cmd}")
+		results = task_utils.execute_autopkg(cmd)
+
+	passed, failed = task_utils.run_async(
+		utility.parse_verify_trust_info_output(results["stdout"], results["stderr"]))
+	task_utils.run_async(core.trust.record(passed & set(recipe_ids), failed.keys()))
+
+	return results, passed, failed
+
+
+@shared_task(base=task_utils.PkgBotTask, name="autopkg:verify_and_run", bind=True)
+def verify_and_run(self, recipe_id: str, autopkg_cmd: dict):
+	"""Verifies the trust info of the passed recipe id and, if it passes, runs it against
+	`autopkg run` in the same task.
+
+	Args:
+		recipe_id (str): Recipe ID of a recipe
+		autopkg_cmd (dict): Contains options for `autopkg` and details on response method
+
+	Returns:
+		dict:  dict describing the results of the ran process
+	"""
+
+	# A retry (waiting on a run slot) does not need to verify the recipe again
+	if self.request.retries and task_utils.run_async(core.trust.get_trusted([ recipe_id ])):
+		return recipe_run(self, {}, recipe_id, autopkg_cmd)
+
+	log.info(f"Verifying trust info for:  {recipe_id}")
+	results, passed, _ = verify_trust_info([ recipe_id ], autopkg_cmd)
+
+	return recipe_run(self, results | { "success": recipe_id in passed }, recipe_id, autopkg_cmd)
+
+
+@shared_task(base=task_utils.PkgBotTask, name="autopkg:verify-trust-batch", bind=True)
+def autopkg_verify_trust_batch(self, recipe_ids: list, autopkg_cmd: dict):
+	"""Runs the passed recipe ids against a single `autopkg verify-trust-info` and queues
+	an `autopkg run` for each recipe that passed.
+
+	Args:
+		recipe_ids (list): Recipe IDs of the recipes to verify
+		autopkg_cmd (dict): Contains options for `autopkg` and details on response method
+
+	Returns:
+		dict:  dict describing the results of the ran process, with the results of each
+			recipe that did not pass in `recipe_results`
+	"""
+
+	log.info(f"Verifying trust info for {len(recipe_ids)} recipes:  {recipe_ids}")
+
+	results, passed, failed = verify_trust_info(recipe_ids, autopkg_cmd)
+	queued_tasks = []
+	recipe_results = []
+
+	for recipe_id in recipe_ids:
+
+		if recipe_id in passed:
+
+			queued_task = run_recipe.apply_async(
+				({"success": True}, recipe_id, autopkg_cmd),
+				queue="autopkg",
+				priority=determine_priority(3, autopkg_cmd.get("ingress"))
+			)
+			queued_tasks.append(queued_task.id)
+			continue
+
+		if recipe_id in failed:
+			log.error(f"Failed to verify trust info for recipe: {recipe_id}")
+			event_type = "verify_trust_info"
+			stderr = failed[recipe_id]
+
+		else:
+			log.error(f"Unknown failure occurred on recipe: {recipe_id}")
+			event_type = "error"
+			stderr = results["stderr"]
+
+		recipe_results.append({
+			"event": event_type,
+			"autopkg_cmd": autopkg_cmd | {"completed": task_utils.run_async(utility.get_timestamp())},
+			"recipe_id": recipe_id,
+			"success": False,
+			"stdout": results["stdout"],
+			"stderr": stderr,
+			"task_id": self.request.id
+		})
+
+	results = {
+		"event": "verify_trust_batch",
+		"queued_tasks": queued_tasks,
+		"recipe_results": recipe_results,
+		"success": not recipe_results,
+		"task_id": self.request.id
+	}
+
+	if recipe_results:
+		notify(self.request.id, results)
+
+	return results
+
+
+@shared_task(base=task_utils.PkgBotTask, name="autopkg:update-trust", bind=True)
 def autopkg_update_trust(
 	self, recipe_id: str, autopkg_cmd: dict, trust_id: int = None, task_id: str | None = None):
 	"""Runs the passed recipe id against `autopkg update-trust-info`.
@@ -626,13 +1095,10 @@ def autopkg_update_trust(
 		if repo_push_branch != active_branch:
 			_ = private_repo.git.checkout(repo_push_branch)
 
-		cmd = f"{config.AutoPkg.get('binary')} update-trust-info {recipe_id} {autopkg_options}"
-
-		if task_utils.get_user_context():
-			cmd = f"su - {task_utils.get_console_user()} -c \"{cmd}\""
+		cmd = [ config.AutoPkg.get("binary"), "update-trust-info", recipe_id, *autopkg_options ]
 
 		# log.debug(f"Command to execute:  {cmd}")
-		results = asyncio.run(utility.execute_process(cmd))
+		results = task_utils.execute_autopkg(cmd)
 
 		if results["stdout"] == f"Didn\'t find a recipe for {recipe_id}.":
 
@@ -665,21 +1131,19 @@ def autopkg_update_trust(
 	if stashed:
 		private_repo.git.stash("pop")
 
-	send_webhook.apply_async((self.request.id,), queue="autopkg", priority=9)
-
-	return {
+	return notify(self.request.id, {
 		"event": "update_trust_info",
 		"event_id": trust_id,
-		"autopkg_cmd": autopkg_cmd | {"completed": asyncio.run(utility.get_timestamp())},
+		"autopkg_cmd": autopkg_cmd | {"completed": task_utils.run_async(utility.get_timestamp())},
 		"recipe_id": recipe_id,
 		"success": results["success"],
 		"stdout": results["stdout"],
 		"stderr": results["stderr"],
 		"task_id": self.request.id
-	}
+	})
 
 
-@shared_task(name="autopkg:version", bind=True)
+@shared_task(base=task_utils.PkgBotTask, name="autopkg:version", bind=True)
 def autopkg_version(self, autopkg_cmd: dict, task_id: str | None = None):
 	"""Runs `autopkg version`.
 
@@ -691,30 +1155,25 @@ def autopkg_version(self, autopkg_cmd: dict, task_id: str | None = None):
 	"""
 
 	# Build the autopkg command
-	cmd = f"{config.AutoPkg.get('binary')} version"
-
-	if task_utils.get_user_context():
-		cmd = f"su - {task_utils.get_console_user()} -c \"{cmd}\""
+	cmd = [ config.AutoPkg.get("binary"), "version" ]
 
 	# log.debug(f"Command to execute:  {cmd}")
-	results = asyncio.run(utility.execute_process(cmd))
+	results = task_utils.execute_autopkg(cmd)
 
 	if autopkg_cmd.get("ingress") in {"api", "Slack"} and not self.request.parent_id:
-		send_webhook.apply_async((task_id or self.request.id,), queue="autopkg", priority=9)
-
-		return {
+		return notify(task_id or self.request.id, {
 			"event": "autopkg_version",
-			"autopkg_cmd": autopkg_cmd | {"completed": asyncio.run(utility.get_timestamp())},
+			"autopkg_cmd": autopkg_cmd | {"completed": task_utils.run_async(utility.get_timestamp())},
 			"success": results["success"],
 			"stdout": results["stdout"],
 			"stderr": results["stderr"],
 			"task_id": task_id or self.request.id
-		}
+		})
 
 	return results
 
 
-@shared_task(name="autopkg:repo-add", bind=True)
+@shared_task(base=task_utils.PkgBotTask, name="autopkg:repo-add", bind=True)
 def autopkg_repo_add(self, repo: str, autopkg_cmd: dict, task_id: str | None = None):
 	"""Runs the passed recipe id against `autopkg verify-trust-info`.
 
@@ -735,26 +1194,25 @@ def autopkg_repo_add(self, repo: str, autopkg_cmd: dict, task_id: str | None = N
 	# Generate AutoPkg options
 	options = task_utils.generate_autopkg_args(**autopkg_options)
 	# Build the autopkg command
-	cmd = f"{config.AutoPkg.get('binary')} repo-add {repo} {options}"
-
-	if task_utils.get_user_context():
-		cmd = f"su - {task_utils.get_console_user()} -c \"{cmd}\""
+	cmd = [ config.AutoPkg.get("binary"), "repo-add", repo, *options ]
 
 	log.debug(f"Command to execute:  {cmd}")
-	results = asyncio.run(utility.execute_process(cmd))
+	results = task_utils.execute_autopkg(cmd)
 
-	if autopkg_cmd.get("ingress") in {"api", "Slack"} and not self.request.parent_id:
-		send_webhook.apply_async((task_id or self.request.id,), queue="autopkg", priority=9)
+	if results["success"]:
+		# Parent recipes may now be found in the new repo
+		task_utils.run_async(core.trust.invalidate())
 
-		return {
+	if autopkg_cmd.get("ingress") in {"api", "Slack"} and not self.request.parent_id:
+		return notify(task_id or self.request.id, {
 			"event": "repo-add",
-			"autopkg_cmd": autopkg_cmd | {"completed": asyncio.run(utility.get_timestamp())},
+			"autopkg_cmd": autopkg_cmd | {"completed": task_utils.run_async(utility.get_timestamp())},
 			"repo": repo,
 			"success": results["success"],
 			"stdout": results["stdout"],
 			"stderr": results["stderr"],
 			"task_id": task_id or self.request.id
-		}
+		})
 
 	return results
 
@@ -763,21 +1221,20 @@ def autopkg_repo_add(self, repo: str, autopkg_cmd: dict, task_id: str | None = N
 # Jamf Pro Tasks
 
 
-@shared_task(name="pkgbot:cache_policies", bind=True)
-def cache_policies(self, **kwargs):
+@shared_task(base=task_utils.PkgBotTask, name="pkgbot:cache_policies", bind=True)
+async def cache_policies(self, **kwargs):
 
-	start = asyncio.run(utility.get_timestamp())
+	start = await utility.get_timestamp()
 	source = kwargs.get("source")
 	called_by = kwargs.get("called_by")
+	mode = kwargs.get("mode", "full")
 
 	if source == "Scheduled":
-		log.info("Performing nightly task to cache Policies from Jamf Pro...")
+		log.info(f"Performing scheduled {mode} cache of Policies from Jamf Pro...")
 	else:
-		log.info(f"Cache Policies from Jamf Pro was requested by {called_by}")
+		log.info(f"A {mode} cache of Policies from Jamf Pro was requested by {called_by}")
 
-	api_token, api_token_expires = asyncio.run(core.jamf_pro.get_token())
-	all_policies_response = asyncio.run(core.jamf_pro.api(
-		"get", "JSSResource/policies", api_token=api_token))
+	all_policies_response = await core.jamf_pro.api("get", "JSSResource/policies", use_cache=False)
 
 	if all_policies_response.status_code != 200:
 		raise("Failed to get list of Policies!")
@@ -786,112 +1243,200 @@ def cache_policies(self, **kwargs):
 	log.debug(f"Number of Policies in Jamf Pro:  {len(all_policies.get('policies'))}")
 
 	# Get the Policy IDs
-	policy_ids = [ policy.get("id") for policy in all_policies.get("policies") ]
+	policy_ids = { policy.get("id") for policy in all_policies.get("policies") }
 	# log.debug(f"Number of Policy IDs:  {len(policy_ids)}")
 
-	# Get all cached Policies and their IDs
-	all_cache_policies = asyncio.run(core.policy.get())
-	cache_policy_ids = [ policy.policy_id for policy in all_cache_policies ]
-	log.debug(f"Number of cached Policy IDs:  {len(cache_policy_ids)}")
+	# Get all cached Policies, keyed by their IDs
+	cached_policies = {
+		policy.policy_id: policy for policy in await core.policy.get() }
+	log.debug(f"Number of cached Policy IDs:  {len(cached_policies)}")
 
 	# Get Policy IDs from cached Policies if they aren't in the "new" Policy IDs list
 	deleted_policy_ids = [
-		policy_id for policy_id in cache_policy_ids if policy_id not in policy_ids ]
+		policy_id for policy_id in cached_policies.keys() if policy_id not in policy_ids ]
 	log.debug(f"Number of cached Policies to delete:  {len(deleted_policy_ids)}")
 
 	for policy_id in deleted_policy_ids:
 		log.debug(f"Deleting Policy:  {policy_id}")
-		asyncio.run(core.policy.delete( { "policy_id": policy_id } ))
+		await core.policy.delete( { "policy_id": policy_id } )
+
+	policies = all_policies.get("policies")
 
-	place_values = int(math.log10(len(all_policies.get('policies')))) + 1
-	pattern = r'^\d'
-	count = 1
+	if mode == "delta":
+		# Only retrieve the details of Policies that are new or have been renamed
+		policies = [
+			policy for policy in policies
+			if not (cached_policy := cached_policies.get(policy.get("id")))
+			or cached_policy.name != policy.get("name")
+			or not cached_policy.fingerprint
+		]
+		log.debug(f"Number of new or changed Policies:  {len(policies)}")
 
-	if place_values == 2:
-		pattern = f"{pattern}0$"
-	elif place_values == 3:
-		pattern = f"{pattern}00$"
-	elif place_values > 3:
-		pattern = f"{pattern}+00$"
+	fingerprints = {
+		policy_id: policy.fingerprint for policy_id, policy in cached_policies.items() }
 
 	log.debug("Updating Policies...")
+	policy_cache_config = config.PkgBot.get("Policy_Cache") or {}
+	updated = await cache_policy_details(
+		policies,
+		fingerprints,
+		policy_cache_config.get("max_concurrent_requests", 10),
+		policy_cache_config.get("batch_size", 100)
+	)
+	log.debug(f"Number of Policies updated:  {updated}")
 
-	for policy in all_policies.get("policies"):
+	log.info("Caching Policies from Jamf Pro...COMPLETE")
+	return {
+		"event": "cache-policies",
+		"source": source,
+		"called_by": called_by,
+		"mode": mode,
+		"start": start,
+		"completed": await utility.get_timestamp(),
+		"result": f"Successfully cached Policies from Jamf Pro ({updated} updated).",
+		"task_id": self.request.id
+	}
 
-		if count < 11 or re.match(pattern, str(count)):
-			log.debug(f"Policy Progress:  {count}")
 
-		count = count + 1
+@shared_task(base=task_utils.PkgBotTask, name="pkgbot:update_policies", bind=True)
+async def update_policies(self, policy_ids: list | None = None,
+	deleted_policy_ids: list | None = None, deleted_pkg_names: list | None = None,
+	pkg_ids: list | None = None):
+	"""Updates only the passed cached Policies and Packages, e.g. from Jamf Pro webhook events.
 
-		if datetime.now(timezone.utc) > (api_token_expires - timedelta(minutes=5)):
-			log.debug("Replacing API Token...")
-			api_token, api_token_expires = asyncio.run(core.jamf_pro.get_token())
+	When Packages were created or updated, the Jamf Pro Packages are synced and the cached
+	Policies that contain them (by their previous or current name) are updated.
 
-		policy_details_response = asyncio.run(core.jamf_pro.api(
-			"get", f"JSSResource/policies/id/{policy.get('id')}", api_token=api_token))
+	Args:
+		policy_ids (list): IDs of Policies that were created or updated
+		deleted_policy_ids (list): IDs of Policies that were deleted
+		deleted_pkg_names (list): Names of Packages that were deleted
+		pkg_ids (list): IDs of Packages that were created or updated
+
+	Returns:
+		dict:  dict describing the results of the ran process
+	"""
+
+	policy_ids = set(policy_ids or [])
+	deleted_policy_ids = deleted_policy_ids or []
+	deleted_pkg_names = deleted_pkg_names or []
+	pkg_ids = pkg_ids or []
+
+	for policy_id in deleted_policy_ids:
+		if await core.policy.get({ "policy_id": policy_id }):
+			log.debug(f"Deleting Policy:  {policy_id}")
+			await core.policy.delete({ "policy_id": policy_id })
+
+	if deleted_pkg_names:
+		log.debug(f"Deleting manually uploaded Packages:  {deleted_pkg_names}")
+		await core.policy.delete_manual_pkgs(deleted_pkg_names)
+		await core.package.delete_jamf_pkgs({ "name__in": deleted_pkg_names })
+
+	if pkg_ids:
+		previous_names = dict(
+			await models.JamfPackages.filter(id__in=pkg_ids).values_list("id", "name"))
+		await core.package.sync_jamf_pkgs()
+		current_names = dict(
+			await models.JamfPackages.filter(id__in=pkg_ids).values_list("id", "name"))
+
+		policy_ids |= await core.policy.get_policy_ids_by_pkg_names(
+			{ *previous_names.values(), *current_names.values() })
+
+		if renamed_pkg_names := [
+			name for id, name in previous_names.items() if current_names.get(id) != name
+		]:
+			log.debug(f"Removing renamed manually uploaded Packages:  {renamed_pkg_names}")
+			await core.policy.delete_manual_pkgs(renamed_pkg_names)
+
+	updated = 0
+
+	if policy_ids:
+		policy_cache_config = config.PkgBot.get("Policy_Cache") or {}
+		updated = await cache_policy_details(
+			[ { "id": policy_id } for policy_id in policy_ids ],
+			max_concurrent_requests = policy_cache_config.get("max_concurrent_requests", 10),
+			batch_size = policy_cache_config.get("batch_size", 100)
+		)
+
+	return {
+		"event": "update-policies",
+		"result": f"Updated {updated} and deleted {len(deleted_policy_ids)} cached Policies.",
+		"task_id": self.request.id
+	}
+
+
+async def cache_policy_details(policies: list, fingerprints: dict | None = None,
+	max_concurrent_requests: int = 10, batch_size: int = 100):
+	"""Fetches the details of each Policy from Jamf Pro concurrently and
+	caches the Policies in batches as their details are received.
+
+	Args:
+		policies (list): Policies (in dicts, containing their `id` and `name`)
+		fingerprints (dict): Fingerprints of the cached Policies, keyed by Policy ID
+		max_concurrent_requests (int): Maximum number of in-flight requests to Jamf Pro
+		batch_size (int): Number of changed Policies to write per transaction
+
+	Returns:
+		int: Number of Policies that were created or updated
+	"""
+
+	fingerprints = fingerprints or {}
+	semaphore = asyncio.Semaphore(max_concurrent_requests)
+	pkg_ids, manual_pkg_ids = await core.policy.get_pkg_ids()
+	total = len(policies)
+	count = 0
+	updated = 0
+	batch = []
+
+	async def get_policy_details(policy):
+
+		async with semaphore:
+			policy_details_response = await core.jamf_pro.get_policy(
+				policy.get("id"), use_cache=False)
+
+		if policy_details_response.status_code == 404:
+			# The Policy has been deleted since it was listed
+			log.debug(f"Policy no longer exists:  {policy.get('id')}")
+			return None
 
 		if policy_details_response.status_code != 200:
 			raise Exception(
 				f"Failed to get policy details for:  {policy.get('id')}:{policy.get('name')}!")
 
-		policy_details = policy_details_response.json()
-		policy_general = policy_details.get("policy").get("general")
-		policy_packages = policy_details.get("policy").get("package_configuration").get("packages")
-
-		policy_obj, created = asyncio.run(core.policy.create_or_update(
-			schemas.Policy_In(
-				name = policy_general.get("name"),
-				site = policy_general.get("site").get("name"),
-				policy_id = policy_general.get("id")
-			)
-		))
+		# Only the parsed attributes are retained, not the response
+		return await core.policy.parse_policy_details(policy_details_response.json())
 
-		# Clear the current policy <-> package relationship (aka flush table of this Policy)
-		asyncio.run(policy_obj.packages.clear())
-		asyncio.run(policy_obj.packages_manual.clear())
+	for policy_details_request in asyncio.as_completed(
+		[ get_policy_details(policy) for policy in policies ]
+	):
 
-		for package in policy_packages:
+		if policy := await policy_details_request:
 
-			# PkgBot Package -- if exists
-			if not (pkg_object := asyncio.run(
-				core.package.get_or_none({ "pkg_name": package.get("name") })
-			)):
-				# Manually uploaded Package
-				pkg_name = package.get("name")
+			# Skip Policies that have not changed
+			if policy.get("fingerprint") != fingerprints.get(policy.get("policy_id")):
+				batch.append(policy)
 
-				try:
-					version = re.sub("\.(pkg|dmg)", "", pkg_name.rsplit("-", 1)[1])
-				except:
-					version = "1.0"
+		if len(batch) >= batch_size:
+			await core.policy.cache_batch(batch, pkg_ids, manual_pkg_ids)
+			updated = updated + len(batch)
+			batch = []
 
-				pkg_details = {
-					"name": pkg_name.rsplit("-", 1)[0],
-					"pkg_name": pkg_name,
-					"version": version,
-					"status": "prod"
-				}
+		count = count + 1
 
-				pkg_object = (asyncio.run(core.package.get_or_create_manual_pkg(pkg_details)))[0]
+		if count == total or count % max(total // 20, 1) == 0:
+			log.debug(f"Policy Progress:  {count}/{total} ({count * 100 // total}%)")
 
-			asyncio.run(pkg_object.policies.add(policy_obj))
+	if batch:
+		await core.policy.cache_batch(batch, pkg_ids, manual_pkg_ids)
+		updated = updated + len(batch)
 
-	log.info("Caching Policies from Jamf Pro...COMPLETE")
-	return {
-		"event": "cache-policies",
-		"source": source,
-		"called_by": called_by,
-		"start": start,
-		"completed": asyncio.run(utility.get_timestamp()),
-		"result": "Successfully cached all Policies from Jamf Pro.",
-		"task_id": self.request.id
-	}
+	return updated
 
 
-@shared_task(name="pkgbot:package_cleanup", bind=True)
-def package_cleanup(self, **kwargs):
+@shared_task(base=task_utils.PkgBotTask, name="pkgbot:package_cleanup", bind=True)
+async def package_cleanup(self, **kwargs):
 
-	loop = get_or_create_event_loop()
-	start = loop.run_until_complete(utility.get_timestamp())
+	start = await utility.get_timestamp()
 	source = kwargs.get("source")
 	called_by = kwargs.get("called_by")
 
@@ -900,107 +1445,45 @@ def package_cleanup(self, **kwargs):
 	else:
 		log.info(f"Adhoc Package Cleanup was requested by {called_by}")
 
-	log.debug("Getting all packages...")
 	pkg_cleanup_config = config.PkgBot.get("Package_Cleanup")
 	versions_to_keep = kwargs.get("versions_to_keep", pkg_cleanup_config.get("versions_to_keep"))
 	dry_run = kwargs.get("dry_run", pkg_cleanup_config.get("dry_run"))
 	max_allowed_pkgs_to_delete = kwargs.get("maximum_allowed_packages_to_delete")
 
-	packages_json_response = loop.run_until_complete(
-		core.jamf_pro.api("get", "JSSResource/packages"))
-	pkgs = packages_json_response.json().get("packages")
-	groups = collections.defaultdict(list)
-	report = []
-
-	for pkg in pkgs:
-
-		try:
-			head = re.sub(
-				r'\s\((Universal|ARM|Intel)\)',
-				"",
-				re.findall(r'.+?(?=-)', pkg["name"])[0]
-			)
-		except IndexError:
-			head = pkg["name"]
-
-		groups[head].append(pkg)
-
-	for k,v in groups.items():
-		log.debug(f"Software Title:  {k}")
-		# log.debug(f"Software Title:  {k}\nVersions:  {v}")
-
-		if len(v) > versions_to_keep:
-			# Sort by ID -- presumed newer pkg versions have higher integers
-			v = sorted(v, key=lambda item: item["id"], reverse=False)[:-2]
-
-			# Check that we're not going to delete too many packages
-			if len(v) > max_allowed_pkgs_to_delete:
-				log.debug(
-					f"Found {len(v)} packages.  "
-					f"Maximum allowed is {max_allowed_pkgs_to_delete}.  "
-					"Override by setting the 'maximum_allowed_packages_to_delete' argument."
-				)
-
-			# Divide the packages into those to keep and those to delete
-			if packages_to_delete := v[:max_allowed_pkgs_to_delete]:
-				packages_in_use = 0
-
-				for pkg in packages_to_delete:
-
-					if pkgbot_pkg := loop.run_until_complete(
-						core.package.get({ "pkg_name": pkg.get("name") })):
-						pass
-					elif manual_pkg := (loop.run_until_complete(
-						schemas.Package_Manual_Out.from_queryset(
-							models.PackagesManual.filter(**{ "pkg_name": pkg.get("name") })
-					))):
-						pkgbot_pkg = manual_pkg[0]
-
-					if pkgbot_pkg:
-						policy_report = pkgbot_pkg.dict(
-							exclude = { "recipe", "icon", "notes",
-				  				"slack_channel", "slack_ts", "response_url" },
-							exclude_unset = True
-						)
-
-						# Check if packages are in use...
-						if policy_report.get("policies"):
-							packages_in_use = packages_in_use + 1
-
-							for policy in policy_report.get("policies"):
-								# log.debug(f'{policy = }')
-								policy.pop("packages", None)
-								policy.pop("packages_manual", None)
-
-						report.append(policy_report)
-					else:
-						report.append(pkg)
-
-				log.debug(f"Number of packages to delete:  {len(packages_to_delete)}")
-				log.debug(f"Number of packages in use:  {packages_in_use}")
-
-	total_in_use = len([ pkg for pkg in report if pkg.get("policies") ])
+	log.debug("Syncing Jamf Pro Packages...")
+	await core.package.sync_jamf_pkgs()
+	groups = await core.package.get_jamf_pkgs_to_cleanup(
+		versions_to_keep, max_allowed_pkgs_to_delete)
+	report = await core.package.get_cleanup_report(
+		[ pkg for packages_to_delete in groups.values() for pkg in packages_to_delete ])
+
+	for software_title, packages_to_delete in groups.items():
+		log.debug(f"Software Title:  {software_title}")
+		log.debug(f"Number of packages to delete:  {len(packages_to_delete)}")
+		log.debug("Number of packages in use:  "
+			f"{len([ pkg for pkg in packages_to_delete if report[pkg.name].get('policy_count') ])}")
+
+	report = list(report.values())
+	total_in_use = len([ pkg for pkg in report if pkg.get("policy_count") ])
 	log.debug(f"Total packages in report:  {len(report) }")
 	log.debug(f"Total packages in use:  {total_in_use}")
 
 	header = ("id", "name", "version", "pkg_name", "packaged_date", "promoted_date",
-		"last_update", "status", "updated_by", "holds", "notes", "policies")
+		"last_update", "status", "updated_by", "holds", "notes", "policy_count", "policies")
 
-	csv_file = loop.run_until_complete(utility.create_csv(
+	csv_file = await utility.create_csv(
 		data = report,
 		header = header,
 		file_name = "Package Retirement Report.csv",
 		save_path = "/tmp"
-	))
-
-	send_webhook.apply_async((self.request.id,), queue="pkgbot", priority=9)
+	)
 
-	return {
+	return notify(self.request.id, {
 		"event": "package-cleanup",
 		"source": source,
 		"called_by": called_by,
 		"start": start,
-		"completed": loop.run_until_complete(utility.get_timestamp()),
+		"completed": await utility.get_timestamp(),
 		"result": "Package cleanup report has been generated.",
 		"results": {
 			"packages_to_delete": len(report),
@@ -1008,4 +1491,4 @@ def package_cleanup(self, **kwargs):
 			"csv_file": csv_file,
 		},
 		"task_id": self.request.id
-	}
+	}, queue="pkgbot")
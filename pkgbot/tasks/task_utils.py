@@ -1,14 +1,88 @@
 import asyncio
+import fcntl
+import functools
+import inspect
 import os
+import pwd
 import re
+import shlex
+import time
+import uuid
 
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 
-from pkgbot import config
+from celery import Task
+from tortoise import Tortoise
+
+from pkgbot import config, settings
 from pkgbot.utilities import common as utility
 
 
 config = config.load_config()
+log = utility.log
+event_loop = None
+db_pid = None
+# Lines of `autopkg run` output that name the recipe or processor being ran or the receipt
+autopkg_recipe_line = re.compile(r"^Processing (.+)\.\.\.$")
+autopkg_processor_line = re.compile(r"^(?:[\w.\-]+/)?[A-Z]\w*$")
+autopkg_keep_lines = re.compile(r"^Processing .+\.\.\.$|^Receipt written to ")
+
+
+def get_event_loop():
+	"""Get the worker process' long-lived event loop, creating it if needed."""
+
+	global event_loop
+
+	if event_loop is None or event_loop.is_closed():
+		event_loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(event_loop)
+
+	return event_loop
+
+
+def run_async(coroutine):
+	"""Runs the coroutine on the worker process' event loop."""
+
+	return get_event_loop().run_until_complete(coroutine)
+
+
+def init_db():
+	"""Initializes Tortoise ORM on the worker process' event loop, once per process."""
+
+	global db_pid
+
+	if db_pid != os.getpid():
+		run_async(Tortoise.init(config=settings.db.TORTOISE_CONFIG))
+		db_pid = os.getpid()
+
+
+def close_db():
+
+	global db_pid
+
+	if db_pid == os.getpid():
+		run_async(Tortoise.close_connections())
+		db_pid = None
+
+
+class PkgBotTask(Task):
+	"""Base class for PkgBot's Celery tasks.
+
+	Runs `async def` task bodies on the worker process' event loop, so that the event loop,
+	database connections and HTTP client are reused across tasks instead of each
+	`asyncio.run()` creating (and tearing down) a new event loop.
+	"""
+
+	def __call__(self, *args, **kwargs):
+
+		init_db()
+		results = super().__call__(*args, **kwargs)
+
+		if inspect.isawaitable(results):
+			return run_async(results)
+
+		return results
 
 
 def get_user_context():
@@ -18,11 +92,179 @@ def get_user_context():
 
 def get_console_user():
 
-	# Get the Console User
-	results_console_user = asyncio.run(utility.execute_process(
-		"/usr/sbin/scutil", "show State:/Users/ConsoleUser"))
-	return re.sub(
-		"(Name : )|(\n)", "", ( re.search("Name : .*\n", results_console_user["stdout"])[0] ))
+	# Get the Console User (the owner of the console device)
+	return pwd.getpwuid(os.stat("/dev/console").st_uid).pw_name
+
+
+@functools.cache
+def get_run_as():
+	"""Get the options to run AutoPkg commands as the console user, when PkgBot is running
+	as root, instead of wrapping them in `su - <console user> -c "..."`.
+
+	The user is resolved once per worker process.
+
+	Returns:
+		dict:  Keyword arguments for `utility.execute_process`
+	"""
+
+	if not get_user_context():
+		return {}
+
+	user = pwd.getpwnam(get_console_user())
+
+	return {
+		"user": user.pw_uid,
+		"group": user.pw_gid,
+		"extra_groups": os.getgrouplist(user.pw_name, user.pw_gid),
+		"cwd": user.pw_dir,
+		"env": {
+			"HOME": user.pw_dir,
+			"USER": user.pw_name,
+			"LOGNAME": user.pw_name,
+			"SHELL": user.pw_shell,
+			"PATH": "/usr/local/bin:/usr/bin:/bin:/usr/sbin:/sbin"
+		}
+	}
+
+
+def get_runner_socket():
+	"""Get the socket of the AutoPkg runner (`utilities/autopkg_runner.py`), if it is
+	enabled and running.
+
+	Returns:
+		str|None:  Path to the socket
+	"""
+
+	if (socket_path := config.AutoPkg.get("runner_socket")) and os.path.exists(socket_path):
+		return socket_path
+
+
+def execute_with_runner(cmd: list, **kwargs):
+	"""Runs the passed AutoPkg command with the AutoPkg runner.
+
+	Args:
+		cmd (list): The arguments of the command
+		**kwargs:  Passed to `utility.execute_runner`
+
+	Returns:
+		dict|None:  The results in the same form as `utility.execute_process` or None if
+			the AutoPkg runner is not available (i.e. the command was not sent to it)
+	"""
+
+	if not (socket_path := get_runner_socket()):
+		return None
+
+	try:
+		return run_async(utility.execute_runner(socket_path, cmd, **kwargs))
+
+	except OSError as error:
+		# Errors after the command was sent are reported in its results
+		log.warning(f"AutoPkg runner is not available:  {error}")
+		return None
+
+
+def execute_autopkg(cmd: list):
+	"""Runs the passed AutoPkg command as the user AutoPkg is ran as, with the AutoPkg
+	runner if it is available.
+
+	Args:
+		cmd (list): The arguments of the command
+
+	Returns:
+		dict:  The results in the same form as `utility.execute_process`
+	"""
+
+	if results := execute_with_runner(cmd, head_lines=None):
+		return results
+
+	return run_async(utility.execute_process(cmd, **get_run_as()))
+
+
+def run_autopkg(task, cmd: list, recipe_id: str | None = None):
+	"""Runs the passed `autopkg run` command, streaming its output.
+
+	The full output is written to a compressed log file in the `output_log_dir` and only
+	the start and end of it (and the lines needed to parse the results) are returned.
+	While running, the recipe and processor being ran are reported as the `PROGRESS`
+	state of the task; when the recipe changes and otherwise at most once every
+	`progress_interval` seconds.  The AutoPkg runner is used if it is available.
+
+	Args:
+		task (celery.Task): The calling (bound) task
+		cmd (list): The arguments of the `autopkg run` command
+		recipe_id (str|None): Recipe ID of the recipe being ran
+
+	Returns:
+		dict:  The results in the same form as `utility.execute_process`
+	"""
+
+	log_dir = config.AutoPkg.get("output_log_dir", "/tmp/PkgBot/logs")
+	os.makedirs(log_dir, exist_ok=True)
+	current = { "recipe_id": recipe_id, "processor": None }
+	progress_interval = config.AutoPkg.get("progress_interval", 5)
+	last_update = { "time": 0 }
+
+	def progress(line):
+
+		if match := autopkg_recipe_line.match(line):
+			current.update(recipe_id=match[1], processor=None)
+
+		elif autopkg_processor_line.match(line) and line != current["processor"]:
+			current["processor"] = line
+
+			if time.monotonic() - last_update["time"] < progress_interval:
+				return
+
+		else:
+			return
+
+		if task.request.id:
+			task.update_state(state="PROGRESS", meta=dict(current))
+			last_update["time"] = time.monotonic()
+
+	output_options = {
+		"log_file": os.path.join(log_dir, f"{task.request.id or uuid.uuid4()}.log.gz"),
+		"head_lines": config.AutoPkg.get("output_head_lines", 200),
+		"tail_lines": config.AutoPkg.get("output_tail_lines", 1000),
+		"keep": autopkg_keep_lines,
+		"progress": progress
+	}
+
+	if results := execute_with_runner(cmd, **output_options):
+		return results
+
+	return run_async(utility.stream_process(cmd, **output_options, **get_run_as()))
+
+
+def prune_output_logs():
+	"""Removes the `autopkg run` output logs in the `output_log_dir` that are older
+	than `output_log_retention` days.
+
+	Returns:
+		int:  The number of logs that were removed
+	"""
+
+	log_dir = config.AutoPkg.get("output_log_dir", "/tmp/PkgBot/logs")
+	cutoff = time.time() - 86400 * config.AutoPkg.get("output_log_retention", 30)
+	removed = 0
+
+	if not os.path.isdir(log_dir):
+		return removed
+
+	for entry in os.scandir(log_dir):
+
+		try:
+			if (
+				entry.name.endswith(".log.gz") and entry.is_file() and
+				entry.stat().st_mtime < cutoff
+			):
+				os.remove(entry.path)
+				removed = removed + 1
+
+		except OSError as error:
+			log.warning(f"Failed to remove output log {entry.path}:  {error}")
+
+	return removed
 
 
 def check_recipe_schedule(interval, last_ran):
@@ -39,7 +281,7 @@ def check_recipe_schedule(interval, last_ran):
 	"""
 
 	if interval != 0 and last_ran != None:
-		current_time = asyncio.run(utility.utc_to_local(utility.get_timestamp()))
+		current_time = run_async(utility.utc_to_local(utility.get_timestamp()))
 		last_ran_time = datetime.fromisoformat(last_ran)
 		interval_in_hours = interval * 24
 		return current_time - last_ran_time > timedelta(hours=interval_in_hours)
@@ -58,37 +300,37 @@ def api_url_helper():
 
 def generate_autopkg_args(**kwargs):
 
-	options = ""
+	options = []
 
 	# AutoPkg args
 	if kwargs.get("verbose"):
-		options = f"{options} -{kwargs.get('verbose')}"
+		options.append(f"-{kwargs.get('verbose')}")
 
 	if kwargs.get("ignore_parent_trust"):
-		options = f"{options} --ignore-parent-trust-verification-errors"
+		options.append("--ignore-parent-trust-verification-errors")
 
 	if kwargs.get("prefs"):
-		options = f"{options} --prefs=\'{kwargs.get('prefs')}\'"
+		options.append(f"--prefs={kwargs.get('prefs')}")
 	else:
-		options = f"{options} --prefs=\'{os.path.abspath(config.JamfPro_Dev.get('autopkg_prefs'))}\'"
+		options.append(f"--prefs={os.path.abspath(config.JamfPro_Dev.get('autopkg_prefs'))}")
 
 	# PkgBot args
 	if kwargs.get("promote_recipe_id"):
-		options = f"{options} --key \'RECIPE_ID={kwargs.get('promote_recipe_id')}\'"
+		options.extend(("--key", f"RECIPE_ID={kwargs.get('promote_recipe_id')}"))
 
 	if kwargs.get("match_pkg"):
-		options = f"{options} --key \'MATCH_PKG={kwargs.get('match_pkg')}\'"
+		options.extend(("--key", f"MATCH_PKG={kwargs.get('match_pkg')}"))
 
 	if kwargs.get("pkg_only"):
-		options = f"{options} --key \'PKG_ONLY=True\'"
+		options.extend(("--key", "PKG_ONLY=True"))
 
 	if kwargs.get("overrides"):
-		options = f"{options} {kwargs.get('overrides')}"
+		options.extend(shlex.split(kwargs.get("overrides")))
 
 	if kwargs.get("quiet"):
-		options = f"{options} --quiet"
+		options.append("--quiet")
 
-	return options.lstrip()
+	return options
 
 
 def compare_branch_heads(repo, local_branch, remote_branch):
@@ -101,3 +343,71 @@ def compare_branch_heads(repo, local_branch, remote_branch):
 				f"{local_branch}...{remote_branch}@{{u}}"
 			)).split('\t')
 	]
+
+
+def acquire_lock(path: str):
+	"""Acquires an exclusive, non-blocking lock on the file at the passed path.
+
+	The lock is held until the returned file object is closed or the process exits.
+
+	Args:
+		path (str): Path to the lock file
+
+	Returns:
+		file object|None:  The locked file or None if it is locked by another process
+	"""
+
+	lock_file = open(path, "a")
+
+	try:
+		fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+		return lock_file
+
+	except BlockingIOError:
+		lock_file.close()
+		return None
+
+
+@contextmanager
+def autopkg_run_slot(recipe_ids: str | list, slot_type: str = "run"):
+	"""Acquires the lock for the recipe(s) and a slot from the global limit of concurrent
+	`autopkg run`s (`slot_type="run"`) or uploads (`slot_type="upload"`).
+
+	Locks are held across all worker processes and are released when the context exits.
+
+	Args:
+		recipe_ids (str|list): Recipe ID(s) of the recipe(s) that will be ran
+		slot_type (str): The type of slot to acquire
+
+	Yields:
+		bool:  Whether the locks were acquired; if False, the recipe(s) should be ran later
+	"""
+
+	if isinstance(recipe_ids, str):
+		recipe_ids = [ recipe_ids ]
+
+	lock_dir = config.AutoPkg.get("lock_dir", "/tmp/PkgBot/locks")
+	max_slots = max(config.AutoPkg.get(f"max_concurrent_{slot_type}s", 1), 1)
+	locks = []
+	os.makedirs(lock_dir, exist_ok=True)
+
+	try:
+
+		for recipe_id in recipe_ids:
+			if not (recipe_lock := acquire_lock(os.path.join(lock_dir, f"recipe-{recipe_id}.lock"))):
+				break
+			locks.append(recipe_lock)
+
+		else:
+			for index in range(max_slots):
+				if slot_lock := acquire_lock(os.path.join(lock_dir, f"{slot_type}-{index}.lock")):
+					locks.append(slot_lock)
+					break
+
+		yield len(locks) == len(recipe_ids) + 1
+
+	finally:
+
+		for lock in locks:
+			fcntl.flock(lock, fcntl.LOCK_UN)
+			lock.close()
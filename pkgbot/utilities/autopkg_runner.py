@@ -0,0 +1,213 @@
+#!/usr/local/autopkg/python
+"""A long-lived AutoPkg runner.
+
+Imports `autopkg` (and with it, autopkglib and its processors) once and then runs AutoPkg
+commands received over a local (Unix domain) socket, saving the interpreter startup and
+imports of the `autopkg` CLI for each command.
+
+Each connection is handled in a process forked from the warm runner and each command is ran
+in a process forked from that, so that the state of one command cannot leak into another.
+
+This file only uses the standard library; run it with the same Python as AutoPkg, as the
+user AutoPkg runs as, e.g.:
+
+	OBJC_DISABLE_INITIALIZE_FORK_SAFETY=YES \
+		/usr/local/autopkg/python autopkg_runner.py --socket /tmp/PkgBot/autopkg_runner.sock
+
+AutoPkg imports Objective-C frameworks (via PyObjC) and macOS aborts a forked process that
+initializes Objective-C classes that were being initialized in its parent unless
+`OBJC_DISABLE_INITIALIZE_FORK_SAFETY=YES` is set when the runner starts (see the example
+LaunchDaemon); if it is not set, the runner restarts itself with it set.
+
+Protocol (one JSON object per line):
+	Request:  { "argv": [ "/usr/local/bin/autopkg", "run", "<recipe>", ... ] }
+	Response:  { "stdout": "<line>" } and { "stderr": "<line>" } as output is written,
+		followed by { "status": <exit code> }
+"""
+
+import argparse
+import json
+import os
+import selectors
+import socketserver
+import sys
+
+from importlib.machinery import SourceFileLoader
+from importlib.util import module_from_spec, spec_from_loader
+
+
+# Maximum length of a line of output; longer lines are split
+MAX_LINE_LENGTH = 2**16
+VERBS = { "run", "verify-trust-info", "update-trust-info", "version", "repo-add", "repo-update" }
+
+autopkg = None
+
+
+def load_autopkg(binary: str):
+	"""Imports the `autopkg` CLI as a module.
+
+	Args:
+		binary (str): Path to the `autopkg` CLI
+
+	Returns:
+		module:  The `autopkg` module
+	"""
+
+	binary = os.path.realpath(binary)
+	sys.path.insert(0, os.path.dirname(binary))
+	loader = SourceFileLoader("autopkg", binary)
+	module = module_from_spec(spec_from_loader("autopkg", loader))
+	loader.exec_module(module)
+
+	return module
+
+
+def run_command(argv: list, stdout: int, stderr: int):
+	"""Runs the passed AutoPkg command in a forked process with its output written to the
+	passed file descriptors.
+
+	Args:
+		argv (list): The arguments of the AutoPkg command
+		stdout (int): File descriptor to write stdout to
+		stderr (int): File descriptor to write stderr to
+
+	Returns:
+		int:  The process id of the forked process
+	"""
+
+	sys.stdout.flush()
+	sys.stderr.flush()
+
+	if pid := os.fork():
+		return pid
+
+	status = 1
+
+	try:
+		devnull = os.open(os.devnull, os.O_RDONLY)
+		os.dup2(devnull, 0)
+		os.dup2(stdout, 1)
+		os.dup2(stderr, 2)
+		# Output to a pipe is block buffered; line buffer it so it is streamed as it is written
+		sys.stdout = open(1, "w", buffering=1, errors="backslashreplace", closefd=False)
+		sys.stderr = open(2, "w", buffering=1, errors="backslashreplace", closefd=False)
+		status = autopkg.main(argv)
+
+	except SystemExit as error:
+		status = error.code if isinstance(error.code, int) else 1
+
+	except BaseException as error:
+		print(f"{type(error).__name__}:  {error}", file=sys.stderr)
+
+	finally:
+		sys.stdout.flush()
+		sys.stderr.flush()
+		os._exit(status or 0)
+
+
+class AutoPkgRunnerHandler(socketserver.StreamRequestHandler):
+
+	def setup(self):
+
+		# Handled in a forked process; the runner keeps listening
+		self.server.socket.close()
+		super().setup()
+
+	def send(self, message: dict):
+
+		self.wfile.write(f"{json.dumps(message, ensure_ascii=False)}\n".encode())
+
+	def handle(self):
+
+		try:
+			request = json.loads(self.rfile.readline())
+			argv = request.get("argv")
+
+			if not isinstance(argv, list) or len(argv) < 2 or argv[1] not in VERBS:
+				raise ValueError(f"Unsupported command:  {argv}")
+
+		except ValueError as error:
+			self.send({ "stderr": str(error) })
+			self.send({ "status": 2 })
+			return
+
+		stdout_read, stdout_write = os.pipe()
+		stderr_read, stderr_write = os.pipe()
+		pid = run_command([ str(arg) for arg in argv ], stdout_write, stderr_write)
+		os.close(stdout_write)
+		os.close(stderr_write)
+
+		selector = selectors.DefaultSelector()
+		selector.register(stdout_read, selectors.EVENT_READ, [ "stdout", b"" ])
+		selector.register(stderr_read, selectors.EVENT_READ, [ "stderr", b"" ])
+
+		while selector.get_map():
+
+			for key, _ in selector.select():
+
+				stream, buffer = key.data
+				data = os.read(key.fd, MAX_LINE_LENGTH)
+
+				if not data:
+					if buffer:
+						self.send({ stream: buffer.decode(errors="replace") })
+					selector.unregister(key.fd)
+					os.close(key.fd)
+					continue
+
+				*lines, buffer = (buffer + data).split(b"\n")
+
+				for line in lines:
+					# Lines longer than the limit are split
+					for index in range(0, max(len(line), 1), MAX_LINE_LENGTH):
+						self.send({ stream: line[index:index + MAX_LINE_LENGTH].decode(errors="replace") })
+
+				while len(buffer) > MAX_LINE_LENGTH:
+					self.send({ stream: buffer[:MAX_LINE_LENGTH].decode(errors="replace") })
+					buffer = buffer[MAX_LINE_LENGTH:]
+
+				key.data[1] = buffer
+
+		_, wait_status = os.waitpid(pid, 0)
+		self.send({ "status": os.waitstatus_to_exitcode(wait_status) })
+
+
+class AutoPkgRunner(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+	pass
+
+
+def main():
+
+	parser = argparse.ArgumentParser(description="Runs AutoPkg commands received over a socket.")
+	parser.add_argument("--socket", default="/tmp/PkgBot/autopkg_runner.sock",
+		help="Path to the socket to listen on")
+	parser.add_argument("--autopkg", default="/usr/local/bin/autopkg",
+		help="Path to the `autopkg` CLI")
+	parser.add_argument("--max-children", type=int, default=40,
+		help="Maximum number of commands to run at once")
+	args = parser.parse_args()
+
+	if sys.platform == "darwin" and os.environ.get("OBJC_DISABLE_INITIALIZE_FORK_SAFETY") != "YES":
+		# Must be set before the Objective-C runtime is loaded, i.e. when the process starts
+		os.environ["OBJC_DISABLE_INITIALIZE_FORK_SAFETY"] = "YES"
+		os.execv(sys.executable, [ sys.executable, *sys.argv ])
+
+	global autopkg
+	autopkg = load_autopkg(args.autopkg)
+
+	os.makedirs(os.path.dirname(args.socket), exist_ok=True)
+
+	if os.path.exists(args.socket):
+		os.remove(args.socket)
+
+	# Only the owner (and root) may run commands
+	os.umask(0o077)
+
+	with AutoPkgRunner(args.socket, AutoPkgRunnerHandler) as server:
+		server.max_children = args.max_children
+		print(f"Listening on:  {args.socket}", flush=True)
+		server.serve_forever()
+
+
+if __name__ == "__main__":
+	main()
@@ -1,15 +1,15 @@
-import asyncio
-
 from celery import current_app as pkgbot_celery_app
 from celery.schedules import crontab
+from celery.signals import worker_process_init, worker_process_shutdown
+
+from pkgbot import config, core, settings
+from pkgbot.tasks import task, task_utils
 
-from tortoise import Tortoise
 
-from pkgbot import settings
-from pkgbot.tasks import task
+config = config.load_config()
 
 
-async def create_celery(celery_app=pkgbot_celery_app):
+def create_celery(celery_app=pkgbot_celery_app):
 
 	celery_app.config_from_object(settings.celery.settings)
 	celery_app.conf.update(task_acks_late=True)
@@ -21,7 +21,19 @@ async def create_celery(celery_app=pkgbot_celery_app):
 			"task": "pkgbot:cache_policies",
 			"schedule": crontab(minute=0, hour=1),
 			"args": (),
-			"kwargs": { "source": "Scheduled", "called_by": "Celery Beat" },
+			"kwargs": { "source": "Scheduled", "called_by": "Celery Beat", "mode": "full" },
+			"options": {
+				"priority": 10,
+				"queue": "pkgbot"
+			}
+		},
+		# Executes every `delta_sync_interval` minutes (default:  hourly)
+		"cache_policies_delta": {
+			"task": "pkgbot:cache_policies",
+			"schedule": 60.0 * (
+				config.PkgBot.get("Policy_Cache") or {}).get("delta_sync_interval", 60),
+			"args": (),
+			"kwargs": { "source": "Scheduled", "called_by": "Celery Beat", "mode": "delta" },
 			"options": {
 				"priority": 10,
 				"queue": "pkgbot"
@@ -38,6 +50,16 @@ async def create_celery(celery_app=pkgbot_celery_app):
 				"queue": "pkgbot"
 			}
 		},
+		# Executes daily at 2:00 A.M.
+		"prune_output_logs": {
+			"task": "autopkg:prune_output_logs",
+			"schedule": crontab(minute=0, hour=2),
+			"args": (),
+			"options": {
+				"priority": 10,
+				"queue": "autopkg"
+			}
+		},
 		# Test Task
 		# "test": {
 		# 	"task": "pkgbot.tasks.task.test",
@@ -53,9 +75,22 @@ async def create_celery(celery_app=pkgbot_celery_app):
 	# celery_app.conf.update(result_persistent=True)
 	# celery_app.conf.update(worker_send_task_events=False)
 
-	await Tortoise.init(config=settings.db.TORTOISE_CONFIG)
-
 	return celery_app
 
 
-celery_app = asyncio.run(create_celery(celery_app=pkgbot_celery_app))
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+
+	task_utils.get_event_loop()
+	task_utils.init_db()
+	core.jamf_pro.http_client.start()
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+
+	task_utils.run_async(core.jamf_pro.http_client.close())
+	task_utils.close_db()
+
+
+celery_app = create_celery(celery_app=pkgbot_celery_app)
@@ -1,7 +1,10 @@
 import asyncio
+import collections
 import csv
+import gzip
 import hashlib
 import hmac
+import json
 import logging.config
 import os
 # import pickle
@@ -53,30 +56,49 @@ def log_setup(name="PkgBot"):
 
 
 log = log_setup()
+# Maximum length of a line read from a streamed process; longer lines are split
+max_line_length = 2**16
+# Ordinals of the version components that denote a pre-release, in release order
+pre_release_tags = { "dev": 0, "a": 1, "alpha": 1, "b": 2, "beta": 2, "rc": 3 }
 
 
-async def execute_process(command, input=None):
+async def create_process(command, **kwargs):
+	"""Starts the passed command; a str is ran by the shell and a list (of arguments)
+	is executed directly.
+
+	Args:
+		command (str|list):  The command line level syntax that would be
+			written in shell or a terminal window, or the arguments of the command.
+		**kwargs:  Passed to the subprocess (e.g. `user`, `group`, `env`)
+	Returns:
+		asyncio.subprocess.Process
+	"""
+
+	if isinstance(command, str):
+		return await asyncio.create_subprocess_shell(command, **kwargs)
+
+	if isinstance(command, list):
+		return await asyncio.create_subprocess_exec(*command, **kwargs)
+
+	raise TypeError('Command must be a str or list type')
+
+
+async def execute_process(command, input=None, **kwargs):
 	"""
 	A helper function for asyncio's subprocess.
 
 	Args:
-		command (str):  The command line level syntax that would be
-			written in shell or a terminal window.
+		command (str|list):  The command line level syntax that would be
+			written in shell or a terminal window, or the arguments of the command.
+		**kwargs:  Passed to the subprocess (e.g. `user`, `group`, `env`)
 	Returns:
 		Results in a dictionary.
 	"""
 
-	# Validate that command is not a string
-	if not isinstance(command, str):
-		raise TypeError('Command must be a str type')
-
-	# Format the command
-	# command = shlex.quote(command)
-
 	# Run the command
-	process = await asyncio.create_subprocess_shell(
+	process = await create_process(
 		command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
-		stderr=asyncio.subprocess.PIPE)
+		stderr=asyncio.subprocess.PIPE, **kwargs)
 
 	if input:
 		(stdout, stderr) = await process.communicate(input=bytes(input, "utf-8"))
@@ -91,6 +113,222 @@ async def execute_process(command, input=None):
 	}
 
 
+class OutputBuffer:
+	"""Keeps the first `head_lines` and last `tail_lines` lines of a stream of output (and
+	any line in between matching `keep`), so that memory use does not grow with the output.
+	If `head_lines` is None, all lines are kept.
+	"""
+
+	def __init__(self, head_lines: int | None = 200, tail_lines: int = 1000,
+		keep: re.Pattern | None = None, log_file: str | None = None):
+
+		self.head_lines = head_lines
+		self.keep = keep
+		self.log_file = log_file
+		self.head = []
+		self.tail = collections.deque(maxlen=tail_lines)
+		self.kept = []
+		self.truncated = 0
+
+	def append(self, line: str):
+
+		if self.head_lines is None or len(self.head) < self.head_lines:
+			self.head.append(line)
+			return
+
+		if len(self.tail) == self.tail.maxlen:
+			evicted = self.tail.popleft()
+
+			if self.keep and self.keep.search(evicted):
+				self.kept.append(evicted)
+			else:
+				self.truncated += 1
+
+		self.tail.append(line)
+
+	def __str__(self):
+
+		head = self.head
+
+		if self.truncated:
+			head = head + [
+				f"[...{self.truncated} lines truncated; full output in:  {self.log_file}...]" ]
+
+		return "\n".join(head + self.kept + list(self.tail)).strip()
+
+
+async def stream_process(command: str | list, log_file: str | None = None, head_lines: int = 200,
+	tail_lines: int = 1000, keep: re.Pattern | None = None, progress: callable = None, **kwargs):
+	"""Runs the passed command and reads its output as it is written, instead of buffering
+	all of it like `execute_process`.
+
+	Only the first `head_lines` and last `tail_lines` lines of stdout and stderr (and any
+	line in between matching `keep`) are returned; the full output is written to a gzip
+	compressed `log_file`.
+
+	Args:
+		command (str|list):  The command line level syntax that would be
+			written in shell or a terminal window, or the arguments of the command.
+		log_file (str|None): Path to write the full output to
+		head_lines (int): Number of lines to return from the start of each stream
+		tail_lines (int): Number of lines to return from the end of each stream
+		keep (re.Pattern|None): Lines that are always returned
+		progress (callable): Called with each line of stdout as it is read
+		**kwargs:  Passed to the subprocess (e.g. `user`, `group`, `env`)
+
+	Returns:
+		dict:  The results in the same form as `execute_process`, and the `log_file`
+	"""
+
+	process = await create_process(
+		command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+		limit=max_line_length, **kwargs)
+
+	log_fd = gzip.open(log_file, "wt", encoding="utf-8") if log_file else None
+
+	async def read_stream(stream, callback=None):
+
+		output = OutputBuffer(head_lines, tail_lines, keep, log_file)
+
+		while True:
+
+			try:
+				line = await stream.readuntil(b"\n")
+			except asyncio.IncompleteReadError as error:
+				line = error.partial
+			except asyncio.LimitOverrunError as error:
+				# Lines longer than the limit are split
+				line = await stream.read(error.consumed)
+
+			if not line:
+				break
+
+			line = line.decode(errors="replace").rstrip("\n")
+
+			if log_fd:
+				log_fd.write(f"{line}\n")
+
+			if callback:
+				try:
+					callback(line)
+				except Exception as error:
+					log.debug(f"Progress callback failed:  {error}")
+
+			output.append(line)
+
+		return str(output)
+
+	try:
+		stdout, stderr = await asyncio.gather(
+			read_stream(process.stdout, progress), read_stream(process.stderr))
+		await process.wait()
+
+	finally:
+		if log_fd:
+			log_fd.close()
+
+	return {
+		"stdout": stdout,
+		"stderr": stderr,
+		"status": process.returncode,
+		"success": process.returncode == 0,
+		"log_file": log_file
+	}
+
+
+async def execute_runner(socket_path: str, command: list, log_file: str | None = None,
+	head_lines: int | None = 200, tail_lines: int = 1000, keep: re.Pattern | None = None,
+	progress: callable = None):
+	"""Runs the passed AutoPkg command with the AutoPkg runner (`autopkg_runner.py`)
+	listening on the passed socket, instead of starting `autopkg` in a new process.
+
+	Output is buffered in the same manner as `stream_process`.  Errors connecting to the
+	runner or sending it the command are raised; if the connection fails after the command
+	was sent, the command is reported as failed, with the error in `stderr`.
+
+	Args:
+		socket_path (str): Path to the socket of the AutoPkg runner
+		command (list): The arguments of the AutoPkg command
+		log_file (str|None): Path to write the full output to
+		head_lines (int|None): Number of lines to return from the start of each stream;
+			if None, all lines are returned
+		tail_lines (int): Number of lines to return from the end of each stream
+		keep (re.Pattern|None): Lines that are always returned
+		progress (callable): Called with each line of stdout as it is read
+
+	Returns:
+		dict:  The results in the same form as `execute_process`, and the `log_file`
+	"""
+
+	reader, writer = await asyncio.open_unix_connection(
+		socket_path, limit=max_line_length * 8)
+
+	try:
+		writer.write(f"{json.dumps({ 'argv': command })}\n".encode())
+		await writer.drain()
+
+	except OSError:
+		writer.close()
+		raise
+
+	log_fd = gzip.open(log_file, "wt", encoding="utf-8") if log_file else None
+	output = {
+		"stdout": OutputBuffer(head_lines, tail_lines, keep, log_file),
+		"stderr": OutputBuffer(head_lines, tail_lines, keep, log_file)
+	}
+	status = None
+	error_message = "The AutoPkg runner closed the connection before the command completed"
+
+	try:
+
+		while message := await reader.readline():
+
+			message = json.loads(message)
+
+			if "status" in message:
+				status = message.get("status")
+				break
+
+			stream, line = next(iter(message.items()))
+
+			if log_fd:
+				log_fd.write(f"{line}\n")
+
+			if progress and stream == "stdout":
+				try:
+					progress(line)
+				except Exception as error:
+					log.debug(f"Progress callback failed:  {error}")
+
+			output[stream].append(line)
+
+	# e.g. the runner crashed or restarted, or sent a truncated or too long message
+	except (OSError, asyncio.IncompleteReadError, ValueError) as error:
+		error_message = f"Lost the connection to the AutoPkg runner:  {error!r}"
+
+	finally:
+		writer.close()
+
+		if status is None:
+			log.error(error_message)
+			output["stderr"].append(error_message)
+			status = 1
+
+			if log_fd:
+				log_fd.write(f"{error_message}\n")
+
+		if log_fd:
+			log_fd.close()
+
+	return {
+		"stdout": str(output["stdout"]),
+		"stderr": str(output["stderr"]),
+		"status": status,
+		"success": status == 0,
+		"log_file": log_file
+	}
+
+
 async def ask_yes_or_no(question):
 	"""Ask a yes/no question via input() and determine the value of the answer.
 
@@ -211,43 +449,42 @@ async def replace_sensitive_strings(message, sensitive_strings=None, sensitive_r
 		return found_sensitive_strings
 
 
-	async def parse_dict(message: dict, all_sensitive_strings: str):
-		"""Parse a dict object and replace sensitive strings if required.
+	async def parse_value(value, all_sensitive_strings: str):
+		"""Parse an object and replace sensitive strings if required.
 
 		Args:
-			message (dict): Object that will be parsed.
+			value (any): Object that will be parsed.
 
 		Returns:
 			(any): The received object will be returned, modified if required.
 		"""
 
-		if isinstance(message, dict):
+		if value is None or isinstance(value, (bool, int, float)):
+			return value
 
-			for key, value in message.items():
-				if value is not None:
+		if isinstance(value, dict):
+			return await parse_dict(value, all_sensitive_strings)
 
-					if isinstance(value, (bool, int)):
-						message[key] = value
+		if isinstance(value, (list, set, tuple)):
+			return type(value)([ await parse_value(item, all_sensitive_strings) for item in value ])
 
-					elif isinstance(value, (list, set, tuple)):
+		return re.sub(rf"{all_sensitive_strings}", '<redacted>', str(value))
 
-						if isinstance(value, list):
-							new_obj = []
-						elif isinstance(value, set):
-							new_obj = set()
-						elif isinstance(value, tuple):
-							new_obj = ()
 
-						for item in value:
-							new_obj.append(re.sub(rf"{all_sensitive_strings}", '<redacted>', item))
+	async def parse_dict(message: dict, all_sensitive_strings: str):
+		"""Parse a dict object and replace sensitive strings if required.
 
-						message[key] = new_obj
+		Args:
+			message (dict): Object that will be parsed.
+
+		Returns:
+			(any): The received object will be returned, modified if required.
+		"""
 
-					elif isinstance(value, dict):
-						message[key] = await parse_dict(value, all_sensitive_strings)
+		if isinstance(message, dict):
 
-					else:
-						message[key] = re.sub(rf"{all_sensitive_strings}", '<redacted>', str(value))
+			for key, value in message.items():
+				message[key] = await parse_value(value, all_sensitive_strings)
 
 		return message
 
@@ -317,6 +554,47 @@ async def find_receipt_plist(content: str):
 	return await plist_reader(run_receipt)
 
 
+async def split_recipe_list_output(content: str):
+	"""Splits the output of an `autopkg run --recipe-list` into the output of each recipe.
+
+	Args:
+		content (str): stdout of the `autopkg run`
+
+	Returns:
+		dict: Output of each recipe, keyed by the recipe as it was passed in the recipe list
+	"""
+
+	recipe_output = {}
+	sections = re.split(r"^Processing (.+)\.\.\.$", content, flags=re.MULTILINE)
+
+	for recipe, output in zip(sections[1::2], sections[2::2]):
+		recipe_output[recipe] = f"Processing {recipe}...{output}"
+
+	return recipe_output
+
+
+async def parse_verify_trust_info_output(stdout: str, stderr: str):
+	"""Parses the per-recipe results of an `autopkg verify-trust-info` of one or more recipes.
+
+	Args:
+		stdout (str): stdout of the `autopkg verify-trust-info`
+		stderr (str): stderr of the `autopkg verify-trust-info`
+
+	Returns:
+		tuple(set, dict):  Recipes that passed and the recipes that failed, with the
+			output of their failure, keyed by the recipe as it was passed
+	"""
+
+	passed = set(re.findall(r"^(.+): OK$", stdout, flags=re.MULTILINE))
+	failed = {}
+	sections = re.split(r"^(.+): FAILED$", stderr, flags=re.MULTILINE)
+
+	for recipe, output in zip(sections[1::2], sections[2::2]):
+		failed[recipe] = f"{recipe}: FAILED{output}".rstrip()
+
+	return passed, failed
+
+
 async def parse_recipe_receipt(content: dict, key: str):
 
 	for step in reversed(content):
@@ -326,6 +604,57 @@ async def parse_recipe_receipt(content: dict, key: str):
 			return step
 
 
+async def parse_pkg_name(pkg_name: str):
+	"""Parses the normalized software title and version from a package name, e.g.
+	`Google Chrome (Universal)-116.0.5845.96.pkg` --> (`google chrome`, `116.0.5845.96`)
+
+	Args:
+		pkg_name (str): Name of a package
+
+	Returns:
+		tuple: (software title, version | None)
+	"""
+
+	title, _, version = re.sub(
+		r"\.(pkg|mpkg|dmg|zip)$", "", pkg_name, flags=re.IGNORECASE).partition("-")
+	title = re.sub(r"\s\((Universal|ARM|Intel)\)", "", title, flags=re.IGNORECASE)
+	return re.sub(r"[\s_]+", " ", title).strip().casefold(), version or None
+
+
+async def version_key(version: str | None):
+	"""Builds a key from a version string that sorts (as a string, e.g. in SQL) in version order.
+
+	Numeric components are prefixed with their length, pre-release components (`dev`, `a`,
+	`alpha`, `b`, `beta`, `rc`) sort before the release they precede and any other component
+	(e.g. `Universal`) sorts after it, e.g.:
+		1.0b1 < 1.0rc1 < 1.0 < 1.0-Universal < 1.0.1 < 1.10 < 1.10000000000
+
+	Args:
+		version (str | None): A version string
+
+	Returns:
+		str | None: The sortable key
+	"""
+
+	if not version:
+		return None
+
+	# Separators, in sort order:  pre-release < end of version < other < numeric
+	key = ""
+
+	for component in re.findall(r"\d+|[a-zA-Z]+", version):
+
+		if component.isdigit():
+			component = component.lstrip("0") or "0"
+			key = f"{key}/{len(component):02d}{component}"
+		elif (pre_release := pre_release_tags.get(component.lower())) is not None:
+			key = f"{key},{pre_release}"
+		else:
+			key = f"{key}.{component.lower()}"
+
+	return f"{key}-"[:256]
+
+
 async def split_string(string: str, split_on: str = " ", split_index: int = 1):
 
 	return string.split(split_on, split_index)
@@ -362,7 +691,7 @@ async def parse_slash_cmd_options(cmd_text: str, verb: str):
 			if sep != "=":
 				raise Exception(f"Error processing override --key `{override_pair}`")
 
-			overrides = f"{overrides} --key '{key}={value}'"
+			overrides = f"{overrides} --key {shlex.quote(f'{key}={value}')}"
 
 		if option == "--ignore-parent-trust-verification-errors":
 			final_options["ignore_parent_trust"] = True